@@ -1,10 +1,13 @@
 import logging
 
-from flask import Flask
+from flask import Flask, Response, abort, request
 
-from services.zoom import live_events, past_participants, add_registrant_onevent, list_registrants_onevent
-from services.webinarmgmt import set_zoom_webinar,last_zoom_webinar, get_members_add_member, list_webinars, global_action
+from services.zoom import live_events, collector_daemon, past_participants, add_registrant_onevent, list_registrants_onevent
+from services.webinarmgmt import set_zoom_webinar,last_zoom_webinar, get_members_add_member, list_webinars, global_action, backfill_last_webinar
+from services.archive import archive_query, archive_import
 from utils.logger import setup_logs
+from utils.livestore import store
+from utils.metrics import registry
 
 app = Flask(__name__)
 
@@ -17,10 +20,54 @@ logger = logging.getLogger('zoom-dashboard')
 def hello_world():
     return 'Hello, World!'
 
+
+def _document_response(path):
+    """
+    Serve a document of the live store, 304 if the client has it already, gzipped if it accepts it
+    """
+    document = store.get(path)
+    if document is None:
+        abort(404)
+    if request.if_none_match.contains_weak(document.etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(document.gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(document.body, mimetype='application/json')
+    response.set_etag(document.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Metrics of this process in the Prometheus text format, see utils.metrics"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/live')
+def live():
+    """Summaries of the live collectors running in this process, see collector-daemon --serve"""
+    return _document_response('live')
+
+
+@app.route('/live/<any(meetings, webinars):kind>')
+def live_snapshot(kind):
+    """Summary and records of the last iteration of a live collector"""
+    return _document_response('live/{}'.format(kind))
+
+
+@app.route('/live/<any(meetings, webinars):kind>/summary')
+def live_summary(kind):
+    return _document_response('live/{}/summary'.format(kind))
+
 #
 # Add the Command Line commands
 #
 app.cli.add_command(live_events)
+app.cli.add_command(collector_daemon)
 app.cli.add_command(past_participants)
 app.cli.add_command(add_registrant_onevent)
 app.cli.add_command(list_registrants_onevent)
@@ -28,4 +75,7 @@ app.cli.add_command(set_zoom_webinar)
 app.cli.add_command(last_zoom_webinar)
 app.cli.add_command(get_members_add_member)
 app.cli.add_command(list_webinars)
-app.cli.add_command(global_action)
\ No newline at end of file
+app.cli.add_command(global_action)
+app.cli.add_command(backfill_last_webinar)
+app.cli.add_command(archive_query)
+app.cli.add_command(archive_import)
\ No newline at end of file
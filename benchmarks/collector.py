@@ -0,0 +1,120 @@
+"""
+End-to-end throughput benchmark of the live_events collectors against benchmarks.fakezoom.
+
+Each mode runs one iteration of ``flask live-events`` in this process, with a throw-away
+LOG_DIR and config.py pointing to a fake Zoom API running in a child process, and reports
+records written per second, API calls, 429s, new connections, time slept and peak memory:
+
+    python -m benchmarks.collector --live-meetings 20000 --webinar-participants 5000
+    python -m benchmarks.collector --modes past-meetings --concurrency 8 --latency 0.05
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.common import use_temp_config
+from benchmarks.fakezoom import add_account_arguments, account_kwargs, start_in_process
+
+MODES = {
+    'live-meetings': (['--meeting'], ['zoom-meetings-live.log']),
+    'live-webinars': ([], ['zoom-webinars-live.log']),
+    'past-meetings': (['--meeting', '--past'], ['zoom-meetings-past.log', 'zoom-meetings-pasticipants.log']),
+    'past-webinars': (['--past'], ['zoom-webinars-past.log', 'zoom-webinars-pasticipants.log']),
+}
+
+
+class SleepCounter(object):
+    """Wraps time.sleep to account for the time the collector spends sleeping"""
+
+    def __init__(self):
+        self.slept = 0.0
+        self._sleep = time.sleep
+
+    def __call__(self, seconds):
+        self.slept += seconds
+        self._sleep(seconds)
+
+    def __enter__(self):
+        time.sleep = self
+        return self
+
+    def __exit__(self, *args):
+        time.sleep = self._sleep
+
+
+def _count_lines(log_dir, names):
+    total = 0
+    for name in names:
+        for path in glob.glob(os.path.join(log_dir, '{}*'.format(name))):
+            with open(path, 'rb') as f:
+                total += sum(1 for _ in f)
+    return total
+
+
+def run_mode(app, live_events, url, log_dir, mode, extra_args):
+    args, logs = MODES[mode]
+    requests.post('{}/_reset'.format(url))
+    before = _count_lines(log_dir, logs)
+    tracemalloc.start()
+    start = time.time()
+    with SleepCounter() as sleeps:
+        result = app.test_cli_runner().invoke(live_events, args + extra_args)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if result.exception:
+        raise result.exception
+    stats = requests.get('{}/_stats'.format(url)).json()
+    records = _count_lines(log_dir, logs) - before
+    return {
+        'mode': mode,
+        'seconds': round(elapsed, 3),
+        'records': records,
+        'records_per_second': round(records / elapsed, 1) if elapsed else 0,
+        'api_calls': sum(stats['calls'].values()),
+        'throttled': stats['throttled'],
+        'connections': stats['connections'],
+        'slept': round(sleeps.slept, 3),
+        'peak_memory_mb': round(peak / 1024.0 / 1024.0, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the live_events collectors')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma separated list of {}'.format(', '.join(MODES)))
+    parser.add_argument('--concurrency', type=int, default=1, help='--concurrency passed to the past modes')
+    parser.add_argument('--json', help='also write the results to this file')
+    add_account_arguments(parser)
+    args = parser.parse_args()
+
+    process, url = start_in_process(**account_kwargs(args))
+    log_dir = use_temp_config(url)
+
+    from app import app
+    from services.zoom import live_events
+
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            extra_args = ['--concurrency', str(args.concurrency)] if mode.startswith('past') else []
+            results.append(run_mode(app, live_events, url.rsplit('/v2', 1)[0], log_dir, mode, extra_args))
+    finally:
+        process.terminate()
+
+    columns = ['mode', 'seconds', 'records', 'records_per_second', 'api_calls', 'throttled',
+               'connections', 'slept', 'peak_memory_mb']
+    print(' '.join('{:>18}'.format(c) for c in columns))
+    for result in results:
+        print(' '.join('{:>18}'.format(result[c]) for c in columns))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
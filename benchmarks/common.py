@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+CONFIG = '''
+LOG_DIR = {log_dir!r}
+ZOOM_BASE_URL = {url!r}
+ZOOM_API_CLIENT = 'benchmark'
+ZOOM_API_SECRET = 'benchmark'
+KEYCLOAK_API_TOKEN_ENDPOINT = KEYCLOAK_ENDPOINT = AUTHZSVC_ENDPOINT = AUTHZ_ENDPOINT = {url!r}
+CLIENT_ID = CLIENT_SECRET = 'benchmark'
+'''
+
+
+def use_temp_config(url='http://127.0.0.1:9/v2'):
+    """Write a config.py with a throw-away LOG_DIR and put it first in sys.path.
+    It has to be called before importing any module of the application.
+
+    Returns:
+        str: the LOG_DIR
+    """
+    log_dir = tempfile.mkdtemp(prefix='zoom-dashboard-bench-')
+    with open(os.path.join(log_dir, 'config.py'), 'w') as f:
+        f.write(CONFIG.format(log_dir=log_dir, url=url))
+    sys.path.insert(0, log_dir)
+    return log_dir
@@ -0,0 +1,176 @@
+"""
+Local stand-in for the Elasticsearch _bulk API and a Logstash http input, to try
+utils.outputs.BulkHTTPSink without a cluster. It counts the documents it gets and
+can be made slow, flaky or down:
+
+    POST /_bulk     Elasticsearch bulk request (action and document lines)
+    POST /          Logstash http input, one json document per line as application/x-ndjson
+    GET  /_stats    requests, documents and rejections since the last reset
+    POST /_reset    reset the stats
+    POST /_down     answer 503 to everything for ?seconds=N
+
+Run it standalone with e.g.:
+
+    python -m benchmarks.fakebulk --port 9200 --fail-rate 0.1
+
+or push records through a BulkHTTPSink, taking the server down in the middle:
+
+    python -m benchmarks.fakebulk --bench 100000 --down-for 5
+"""
+import argparse
+import json
+import random
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeBulkServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate=0.0, latency=0.0, seed=0):
+        HTTPServer.__init__(self, address, FakeBulkHandler)
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.down_until = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'documents': 0, 'rejected': 0, 'bytes': 0, 'types': {}}
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+class FakeBulkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=None):
+        payload = json.dumps(body if body is not None else {}).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/_stats':
+            with self.server.lock:
+                return self._send(200, self.server.stats)
+        self._send(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        if url.path == '/_reset':
+            server.reset()
+            return self._send(200)
+        if url.path == '/_down':
+            server.down_until = time.time() + float(parse_qs(url.query).get('seconds', ['10'])[0])
+            return self._send(200)
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.stats['requests'] += 1
+            if time.time() < server.down_until or server.random.random() < server.fail_rate:
+                server.stats['rejected'] += 1
+                return self._send(503, {'error': 'unavailable'})
+        lines = [line for line in body.decode('utf-8').split('\n') if line]
+        if url.path == '/_bulk':
+            documents = [json.loads(line) for line in lines[1::2]]
+        elif url.path == '/':
+            # like the Logstash http input, whose json codec takes one document or array per body
+            try:
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    documents = json.loads(body.decode('utf-8'))
+                    documents = documents if isinstance(documents, list) else [documents]
+                else:
+                    documents = [json.loads(line) for line in lines]
+            except ValueError as ex:
+                return self._send(400, {'error': str(ex)})
+        else:
+            return self._send(404)
+        with server.lock:
+            server.stats['documents'] += len(documents)
+            server.stats['bytes'] += len(body)
+            for document in documents:
+                doctype = document.get('fields', {}).get('document_type', '')
+                server.stats['types'][doctype] = server.stats['types'].get(doctype, 0) + 1
+        if url.path == '/_bulk':
+            return self._send(200, {'took': 1, 'errors': False,
+                                    'items': [{'index': {'status': 201}} for _ in documents]})
+        self._send(200)
+
+
+def serve(host='127.0.0.1', port=0, fail_rate=0.0, latency=0.0, seed=0):
+    server = FakeBulkServer((host, port), fail_rate=fail_rate, latency=latency, seed=seed)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def bench(server, records, bulk_format, down_for):
+    """Push records through a BulkHTTPSink, with the server down for a while after a third of them"""
+    from benchmarks.common import use_temp_config
+    use_temp_config('http://127.0.0.1:1/v2')
+    from utils.outputs import BulkHTTPSink
+
+    spool = tempfile.mkdtemp(prefix='zoom-spool-')
+    sink = BulkHTTPSink(server.url, 'zoom-meetings-live.log', fields={'fields': {'document_type': 'aggrzeventslive'}},
+                        doctype='aggrzeventslive', bulk_format=bulk_format, flush_interval=0.5, retries=2, spool_dir=spool)
+    started = time.time()
+    for index in range(records):
+        if down_for and index == records // 3:
+            server.down_until = time.time() + down_for
+        sink.write({'type': 'meeting', 'participants': index % 50, 'uuid': 'uuid{}=='.format(index),
+                    'zoomid': 900000000 + index, 'topic': 'Meeting {}'.format(index),
+                    'start_time': '2020-11-24T10:00:00Z'})
+    sink.flush()
+    written = time.time() - started
+    while down_for and server.stats['documents'] < records and time.time() - started < written + down_for + 60:
+        # the spool is resent with the next batch
+        time.sleep(down_for)
+        sink.write({'type': 'meeting', 'participants': 0, 'uuid': 'last', 'zoomid': 0, 'topic': '',
+                    'start_time': '2020-11-24T10:00:00Z'})
+        sink.flush()
+        records += 1
+    sink.close()
+    return {
+        'records': records,
+        'seconds': round(written, 2),
+        'records_per_s': int(records / written) if written else None,
+        'spooled_batches': sink.spooled,
+        'server': server.stats,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for Elasticsearch _bulk and Logstash http')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bench', type=int, default=0, help='push this many records through a BulkHTTPSink and exit')
+    parser.add_argument('--bulk-format', choices=['elasticsearch', 'ndjson'], default='elasticsearch')
+    parser.add_argument('--down-for', type=float, default=0, help='with --bench, seconds the server is down')
+    args = parser.parse_args()
+    if args.bench:
+        server = serve(host=args.host, port=0, fail_rate=args.fail_rate, latency=args.latency)
+        print(json.dumps(bench(server, args.bench, args.bulk_format, args.down_for), indent=2))
+    else:
+        server = serve(host=args.host, port=args.port, fail_rate=args.fail_rate, latency=args.latency)
+        print('Serving fake bulk API on {}'.format(server.url))
+        while True:
+            time.sleep(3600)
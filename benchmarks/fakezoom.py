@@ -0,0 +1,473 @@
+"""
+Local stand-in for the Zoom REST endpoints used by utils.zclient.ZoomAPIClient.
+
+It serves a synthetic account of configurable size, generated on the fly from the
+index of each record so even 20k live meetings don't need to be kept in memory, and
+it enforces Zoom like per category rate limits (429 + X-RateLimit-* headers) and
+latencies. Besides the Zoom paths it answers:
+
+    GET  /_stats    calls, 429s and connections since the last reset
+    POST /_reset    reset the stats
+
+Run it standalone with e.g.:
+
+    python -m benchmarks.fakezoom --port 8765 --live-meetings 20000 --rate resource-intensive=20
+"""
+import argparse
+import base64
+import calendar
+import hashlib
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Process, Queue
+from urllib.parse import urlparse, parse_qs, unquote
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Zoom rate limit category of each route
+ROUTES = [
+    ('GET', r'/metrics/meetings$', 'resource-intensive', 'list_meetings'),
+    ('GET', r'/metrics/webinars$', 'resource-intensive', 'list_webinars'),
+    ('GET', r'/metrics/meetings/(?P<id>.+)/participants$', 'resource-intensive', 'list_participants'),
+    ('GET', r'/metrics/webinars/(?P<id>.+)/participants$', 'resource-intensive', 'list_participants'),
+    ('GET', r'/metrics/meetings/(?P<id>.+)$', 'heavy', 'get_meeting'),
+    ('GET', r'/meetings/(?P<id>.+)/registrants$', 'medium', 'list_registrants'),
+    ('POST', r'/meetings/(?P<id>.+)/registrants$', 'light', 'add_registrant'),
+    ('GET', r'/users/(?P<id>.+)/settings$', 'medium', 'get_settings'),
+    ('PATCH', r'/users/(?P<id>.+)/settings$', 'medium', 'update_settings'),
+    ('GET', r'/users/(?P<id>.+)/webinars$', 'medium', 'list_user_webinars'),
+    ('GET', r'/webinars/(?P<id>.+)$', 'light', 'get_webinar_details'),
+]
+
+DEFAULT_RATES = {
+    'light': 80.0,
+    'medium': 60.0,
+    'heavy': 40.0,
+    'resource-intensive': 20.0,
+}
+
+
+def _iso(epoch):
+    return time.strftime(DATE_FORMAT, time.gmtime(epoch))
+
+
+def _duration(seconds):
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return '{:02d}:{:02d}:{:02d}'.format(h, m, s)
+    return '{:02d}:{:02d}'.format(m, s)
+
+
+class SyntheticAccount(object):
+    """Deterministic synthetic Zoom account, every record is derived from its index.
+
+    Args:
+        live_meetings (int): meetings going on right now
+        past_meetings (int): meetings that ended in the last day
+        live_webinars (int): webinars going on right now
+        past_webinars (int): webinars that ended in the last day
+        meeting_participants (int): average number of participants of a meeting
+        webinar_participants (int): number of participants of a webinar
+        registrants (int): number of registrants of a meeting
+        users (int): number of users owning webinars
+        seed (int): seed of the generator
+    """
+
+    def __init__(self, live_meetings=2000, past_meetings=2000, live_webinars=50, past_webinars=50,
+                 meeting_participants=8, webinar_participants=500, registrants=1000, users=1000, seed=0):
+        self.sizes = {
+            ('meetings', 'live'): live_meetings,
+            ('meetings', 'past'): past_meetings,
+            ('webinars', 'live'): live_webinars,
+            ('webinars', 'past'): past_webinars,
+        }
+        self.meeting_participants = meeting_participants
+        self.webinar_participants = webinar_participants
+        self.registrants = registrants
+        self.users = users
+        self.seed = seed
+        self.now = int(time.time())
+        self.uuids = {}
+
+    def _rand(self, *key):
+        return random.Random('{}-{}'.format(self.seed, '-'.join(str(k) for k in key)))
+
+    def uuid(self, kind, typeofevent, index):
+        digest = hashlib.md5('{}-{}-{}-{}'.format(self.seed, kind, typeofevent, index).encode()).digest()
+        uuid = base64.b64encode(digest).decode()
+        self.uuids[uuid] = (kind, typeofevent, index)
+        return uuid
+
+    def event(self, kind, typeofevent, index):
+        rnd = self._rand(kind, typeofevent, index)
+        if kind == 'meetings':
+            participants = max(1, int(rnd.expovariate(1.0 / self.meeting_participants)))
+        else:
+            participants = max(1, int(self.webinar_participants * rnd.uniform(0.5, 1.5)))
+        if typeofevent == 'live':
+            start = self.now - rnd.randint(60, 3 * 3600)
+        else:
+            start = self.now - rnd.randint(4 * 3600, 26 * 3600)
+        length = rnd.randint(15 * 60, 3 * 3600)
+        host = 'user{}'.format(rnd.randint(0, self.users - 1))
+        record = {
+            'uuid': self.uuid(kind, typeofevent, index),
+            'id': 90000000000 + index,
+            'topic': '{} {} {}'.format(kind[:-1].capitalize(), typeofevent, index),
+            'host': host,
+            'email': '{}@example.org'.format(host),
+            'user_type': 'Licensed',
+            'start_time': _iso(start),
+            'participants': participants,
+            'has_pstn': rnd.random() < 0.1,
+            'has_voip': rnd.random() < 0.9,
+            'has_3rd_party_audio': rnd.random() < 0.01,
+            'has_video': rnd.random() < 0.8,
+            'has_screen_share': rnd.random() < 0.5,
+            'has_recording': rnd.random() < 0.2,
+            'has_sip': rnd.random() < 0.05,
+            'dept': 'IT',
+        }
+        if rnd.random() < 0.05:
+            record['in_room_participants'] = rnd.randint(1, 10)
+        if typeofevent == 'past':
+            record['end_time'] = _iso(start + length)
+            record['duration'] = _duration(length)
+        else:
+            record['duration'] = _duration(self.now - start)
+        return record
+
+    def events(self, kind, typeofevent):
+        return self.sizes[(kind, typeofevent)]
+
+    def participants(self, uuid):
+        kind, typeofevent, index = self.uuids.get(uuid, ('meetings', 'past', 0))
+        event = self.event(kind, typeofevent, index)
+        start = calendar.timegm(time.strptime(event['start_time'], DATE_FORMAT))
+        end = calendar.timegm(time.strptime(event['end_time'], DATE_FORMAT)) if 'end_time' in event else self.now
+        rnd = self._rand('participants', uuid)
+        for i in range(event['participants']):
+            join = rnd.randint(start, max(start, end - 60))
+            leave = rnd.randint(join, end)
+            yield {
+                'id': 'p{}'.format(i),
+                'user_id': str(16778240 + i),
+                'user_name': 'Participant {}'.format(i),
+                'device': rnd.choice(['Windows', 'Mac', 'iOS', 'Android', 'Linux']),
+                'ip_address': '10.{}.{}.{}'.format(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(1, 254)),
+                'location': rnd.choice(['Geneva (CH)', 'Paris (FR)', 'Chicago (US)', 'Tokyo (JP)']),
+                'network_type': rnd.choice(['Wired', 'Wifi', 'Others']),
+                'join_time': _iso(join),
+                'leave_time': _iso(leave),
+                'share_application': False,
+                'share_desktop': rnd.random() < 0.1,
+                'share_whiteboard': False,
+                'recording': False,
+                'pc_name': 'pc{}'.format(i),
+                'domain': 'example.org',
+                'mac_addr': '',
+                'harddisk_id': '',
+                'version': '5.4.7',
+                'leave_reason': 'left the meeting',
+                'email': 'participant{}@example.org'.format(i),
+            }
+
+    def registrant(self, meeting_id, index):
+        return {
+            'id': 'r{}'.format(index),
+            'email': 'registrant{}@example.org'.format(index),
+            'first_name': 'First{}'.format(index),
+            'last_name': 'Last{}'.format(index),
+            'status': 'approved',
+            'create_time': _iso(self.now - index),
+        }
+
+    def user_webinars(self, user):
+        rnd = self._rand('user', user)
+        webinars = []
+        for i in range(rnd.randint(0, 6)):
+            recurring = rnd.random() < 0.3
+            webinars.append({
+                'uuid': self.uuid('user-webinars', user, i),
+                'id': 80000000000 + int(hashlib.md5('{}-{}'.format(user, i).encode()).hexdigest()[:8], 16),
+                'topic': 'Webinar {} of {}{}'.format(i, user, ' 1000attendees' if rnd.random() < 0.2 else ''),
+                'agenda': '',
+                'type': 9 if recurring else 5,
+                'start_time': _iso(self.now + rnd.randint(-90, 90) * 86400),
+                'duration': 60,
+            })
+        return webinars
+
+    def webinar_details(self, webinarid):
+        rnd = self._rand('details', webinarid)
+        return {
+            'id': webinarid,
+            'type': 9,
+            'occurrences': [
+                {'occurrence_id': str(i), 'start_time': _iso(self.now + rnd.randint(-60, 60) * 86400), 'duration': 60}
+                for i in range(rnd.randint(1, 5))
+            ],
+        }
+
+
+class RateLimits(object):
+    """Per category token buckets, answering like Zoom when they are empty."""
+
+    def __init__(self, rates=None):
+        self.rates = dict(DEFAULT_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, category):
+        rate = self.rates[category]
+        with self.lock:
+            now = time.time()
+            tokens, updated = self.buckets.get(category, (rate, now))
+            tokens = min(rate, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[category] = (tokens, now)
+            return allowed, rate, int(tokens)
+
+
+class FakeZoomServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, account, rates=None, latency=0.0, jitter=0.0):
+        HTTPServer.__init__(self, address, FakeZoomHandler)
+        self.account = account
+        self.limits = RateLimits(rates)
+        self.latency = latency
+        self.jitter = jitter
+        self.stats_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.stats_lock:
+            self.stats = {'calls': {}, 'throttled': 0, 'connections': 0}
+
+    def count(self, key, endpoint=None):
+        with self.stats_lock:
+            if endpoint:
+                self.stats['calls'][endpoint] = self.stats['calls'].get(endpoint, 0) + 1
+            else:
+                self.stats[key] += 1
+
+    @property
+    def url(self):
+        return 'http://{}:{}/v2'.format(*self.server_address)
+
+
+class FakeZoomHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode()) if length else {}
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        path = re.sub(r'^/v2', '', parsed.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if path == '/_stats':
+            with self.server.stats_lock:
+                return self._send(200, self.server.stats)
+        if path == '/_reset':
+            self.server.reset()
+            return self._send(200, {})
+        for route_method, pattern, category, endpoint in ROUTES:
+            match = re.match(pattern, path)
+            if route_method != method or not match:
+                continue
+            if self.server.latency or self.server.jitter:
+                time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+            allowed, rate, remaining = self.server.limits.allow(category)
+            headers = {
+                'X-RateLimit-Category': category.title(),
+                'X-RateLimit-Type': 'QPS',
+                'X-RateLimit-Limit': str(int(rate)),
+                'X-RateLimit-Remaining': str(remaining),
+            }
+            if not allowed:
+                self.server.count('throttled')
+                return self._send(429, {'code': 429, 'message': "You have reached the maximum per-second rate limit"}, headers)
+            self.server.count(None, endpoint)
+            kwargs = match.groupdict()
+            if 'id' in kwargs:
+                kwargs['id'] = _unquote_all(kwargs['id'])
+            code, body = getattr(self, endpoint)(query, **kwargs)
+            return self._send(code, body, headers)
+        return self._send(404, {'code': 404, 'message': 'Not found'})
+
+    def do_GET(self):
+        # a body sent with a GET would otherwise be read as the next request
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def _page(self, query, total, key, make):
+        page_size = int(query.get('page_size', 30))
+        offset = int(query.get('next_page_token') or 0)
+        end = min(total, offset + page_size)
+        return 200, {
+            'page_size': page_size,
+            'total_records': total,
+            'next_page_token': str(end) if end < total else '',
+            key: [make(i) for i in range(offset, end)],
+        }
+
+    def list_meetings(self, query):
+        typeofevent = query.get('type', 'live')
+        total = self.server.account.events('meetings', typeofevent)
+        return self._page(query, total, 'meetings', lambda i: self.server.account.event('meetings', typeofevent, i))
+
+    def list_webinars(self, query):
+        typeofevent = query.get('type', 'live')
+        total = self.server.account.events('webinars', typeofevent)
+        return self._page(query, total, 'webinars', lambda i: self.server.account.event('webinars', typeofevent, i))
+
+    def list_participants(self, query, id):
+        participants = list(self.server.account.participants(id))
+        return self._page(query, len(participants), 'participants', lambda i: participants[i])
+
+    def get_meeting(self, query, id):
+        kind, typeofevent, index = self.server.account.uuids.get(id, ('meetings', 'past', 0))
+        return 200, self.server.account.event(kind, typeofevent, index)
+
+    def list_registrants(self, query, id):
+        return self._page(query, self.server.account.registrants, 'registrants',
+                          lambda i: self.server.account.registrant(id, i))
+
+    def add_registrant(self, query, id):
+        body = self._body()
+        return 201, {'id': id, 'registrant_id': hashlib.md5(body.get('email', '').encode()).hexdigest()[:22],
+                     'join_url': 'https://zoom.example.org/w/{}'.format(id)}
+
+    def get_settings(self, query, id):
+        return 200, {'feature': {'webinar': False}}
+
+    def update_settings(self, query, id):
+        self._body()
+        return 204, None
+
+    def list_user_webinars(self, query, id):
+        webinars = self.server.account.user_webinars(id)
+        return 200, {'page_size': 300, 'total_records': len(webinars), 'next_page_token': '', 'webinars': webinars}
+
+    def get_webinar_details(self, query, id):
+        return 200, self.server.account.webinar_details(id)
+
+
+def _unquote_all(value):
+    while True:
+        unquoted = unquote(value)
+        if unquoted == value:
+            return value
+        value = unquoted
+
+
+def serve(host='127.0.0.1', port=0, rates=None, latency=0.0, jitter=0.0, **account):
+    """Create a FakeZoomServer for a SyntheticAccount built with the account kwargs"""
+    return FakeZoomServer((host, port), SyntheticAccount(**account), rates=rates, latency=latency, jitter=jitter)
+
+
+def _serve_forever(queue, kwargs):
+    server = serve(**kwargs)
+    queue.put(server.url)
+    server.serve_forever()
+
+
+def start_in_process(**kwargs):
+    """Run a FakeZoomServer in a child process, so it doesn't count in the collector figures.
+
+    Returns:
+        tuple: (process, base url)
+    """
+    queue = Queue()
+    process = Process(target=_serve_forever, args=(queue, kwargs))
+    process.daemon = True
+    process.start()
+    return process, queue.get(timeout=30)
+
+
+def parse_rates(values):
+    rates = {}
+    for value in values or []:
+        category, rate = value.split('=')
+        rates[category] = float(rate)
+    return rates
+
+
+def add_account_arguments(parser):
+    parser.add_argument('--live-meetings', type=int, default=2000)
+    parser.add_argument('--past-meetings', type=int, default=2000)
+    parser.add_argument('--live-webinars', type=int, default=50)
+    parser.add_argument('--past-webinars', type=int, default=50)
+    parser.add_argument('--meeting-participants', type=int, default=8, help='average participants of a meeting')
+    parser.add_argument('--webinar-participants', type=int, default=500)
+    parser.add_argument('--registrants', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate', action='append', help='category=requests per second e.g. heavy=40')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added on top of latency')
+
+
+def account_kwargs(args):
+    return {
+        'live_meetings': args.live_meetings,
+        'past_meetings': args.past_meetings,
+        'live_webinars': args.live_webinars,
+        'past_webinars': args.past_webinars,
+        'meeting_participants': args.meeting_participants,
+        'webinar_participants': args.webinar_participants,
+        'registrants': args.registrants,
+        'users': args.users,
+        'seed': args.seed,
+        'rates': parse_rates(args.rate),
+        'latency': args.latency,
+        'jitter': args.jitter,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Zoom API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_account_arguments(parser)
+    args = parser.parse_args()
+    server = serve(host=args.host, port=args.port, **account_kwargs(args))
+    print('Serving fake Zoom API on {}'.format(server.url))
+    server.serve_forever()
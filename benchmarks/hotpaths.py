@@ -0,0 +1,224 @@
+"""
+Offline microbenchmarks of the code that runs per record or per iteration of the collectors.
+
+Every benchmark runs on synthetic data at each of the given sizes and reports the best
+time of a few repeats and the cost per record, so numbers are comparable between runs:
+
+    python -m benchmarks.hotpaths
+    python -m benchmarks.hotpaths --sizes 10000,100000 --only cleanArr,convertStrToSec --json before.json
+    python -m benchmarks.hotpaths --baseline before.json --threshold 1.2
+
+With --baseline the exit code is 1 if any benchmark got slower than threshold times the baseline.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.common import use_temp_config
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _iso(epoch):
+    return time.strftime(DATE_FORMAT, time.gmtime(epoch))
+
+
+def _uuid(rnd):
+    return '{:032x}=='.format(rnd.getrandbits(128))
+
+
+def live_meetings(n, seed=0):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    meetings = []
+    for i in range(n):
+        meeting = {
+            'uuid': _uuid(rnd),
+            'id': 90000000000 + i,
+            'topic': 'Meeting {}'.format(i),
+            'host': 'user{}'.format(rnd.randint(0, 1000)),
+            'start_time': _iso(now - rnd.randint(60, 3 * 3600)),
+            'participants': max(1, int(rnd.expovariate(1.0 / 8))),
+            'has_pstn': rnd.random() < 0.1,
+            'has_voip': rnd.random() < 0.9,
+            'has_3rd_party_audio': rnd.random() < 0.01,
+            'has_video': rnd.random() < 0.8,
+            'has_screen_share': rnd.random() < 0.5,
+            'has_recording': rnd.random() < 0.2,
+            'has_sip': rnd.random() < 0.05,
+        }
+        if rnd.random() < 0.05:
+            meeting['in_room_participants'] = rnd.randint(1, 10)
+        meetings.append(meeting)
+    return meetings
+
+
+def participants(n, seed=0):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    records = []
+    for i in range(n):
+        join = now - rnd.randint(4 * 3600, 40 * 3600)
+        records.append({
+            'id': 'p{}'.format(i),
+            'user_id': str(16778240 + i),
+            'user_name': 'Participant {}'.format(i),
+            'device': 'Windows',
+            'ip_address': '10.0.{}.{}'.format(rnd.randint(0, 255), rnd.randint(1, 254)),
+            'location': 'Geneva (CH)',
+            'network_type': 'Wifi',
+            'join_time': _iso(join),
+            'leave_time': _iso(join + rnd.randint(60, 3 * 3600)),
+            'share_desktop': False,
+            'recording': False,
+            'version': '5.4.7',
+            'email': 'participant{}@example.org'.format(i),
+        })
+    return records
+
+
+def uuid_dates(n, days=4, seed=0):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    return {_uuid(rnd): _iso(now - rnd.randint(0, days * 86400)) for _ in range(n)}
+
+
+def durations(n, seed=0):
+    rnd = random.Random(seed)
+    values = []
+    for _ in range(n):
+        seconds = rnd.randint(0, 5 * 3600)
+        h, rem = divmod(seconds, 3600)
+        m, s = divmod(rem, 60)
+        values.append('{:02d}:{:02d}:{:02d}'.format(h, m, s) if h else '{:02d}:{:02d}'.format(m, s))
+    return values
+
+
+def dates(n, seed=0):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    return [_iso(now - rnd.randint(0, 3 * 86400)) for _ in range(n)]
+
+
+def write_log(log_dir, name, n):
+    """Write a log of n participant lines as the past collectors do"""
+    event = {'uuid': None, 'start_time': _iso(int(time.time()))}
+    rnd = random.Random(0)
+    with open(os.path.join(log_dir, name), 'w') as f:
+        for i, participant in enumerate(participants(n)):
+            if i % 20 == 0:
+                event['uuid'] = _uuid(rnd)
+            participant['uuid'] = event['uuid']
+            f.write(json.dumps(participant) + '\n')
+    return name
+
+
+def benchmarks(log_dir):
+    """name: (setup(n) -> data, run(data), setup has to be redone before every run)"""
+    from utils.helper import helper, TimeBucketDedup, DedupIndex
+    from utils.aggregation import LiveAggregator, Rollups
+    from services.zoom import _live_record, _normalize_participant
+
+    def live_records(meetings):
+        for meeting in meetings:
+            if meeting['participants'] > 1:
+                _live_record(meeting, True)
+
+    def normalize(pair):
+        event, records = pair
+        for participant in records:
+            _normalize_participant(participant, event, True)
+
+    def bucketed(n):
+        dedup = TimeBucketDedup()
+        dedup.update(uuid_dates(n))
+        return dedup
+
+    def index(n):
+        name = 'bench-index-{}.log'.format(n)
+        dedup = DedupIndex(name)
+        if len(dedup) == 0:
+            for uuid, start_time in uuid_dates(n, days=1).items():
+                dedup.add(uuid, start_time)
+            dedup.commit()
+        return dedup
+
+    return {
+        'readFileArray': (lambda n: write_log(log_dir, 'bench-participants-{}.log'.format(n), n),
+                          lambda name: helper.readFileArray(name), False),
+        'DedupIndex.load': (index, lambda dedup: dedup.load(), False),
+        'cleanArr': (uuid_dates, lambda arr: helper.cleanArr(arr), False),
+        'TimeBucketDedup.expire': (bucketed, lambda dedup: dedup.expire(), True),
+        'convertStrToSec': (durations, lambda values: [helper.convertStrToSec(v) for v in values], False),
+        'timeDiffinMinutes': (dates, lambda values: [helper.timeDiffinMinutes(v) for v in values], False),
+        'live-summary': (live_meetings, lambda meetings: LiveAggregator(True).add(meetings).summary(''), False),
+        'live-rollups': (live_meetings, lambda meetings: Rollups(True).add(LiveAggregator(True).add(meetings)), False),
+        'live-records': (live_meetings, live_records, False),
+        'participant-normalization': (lambda n: ({'uuid': 'u', 'id': 1}, participants(n)), normalize, True),
+    }
+
+
+def run(selected, sizes, repeat, log_dir):
+    results = []
+    for name, (setup, func, mutates) in benchmarks(log_dir).items():
+        if selected and name not in selected:
+            continue
+        for n in sizes:
+            data = setup(n)
+            best = None
+            for i in range(repeat):
+                if mutates and i:
+                    data = setup(n)
+                start = time.perf_counter()
+                func(data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({'name': name, 'size': n, 'seconds': round(best, 6),
+                            'ns_per_record': round(best * 1e9 / n, 1)})
+            print('{:>28} {:>9} {:>12.4f}s {:>12.1f} ns/record'.format(name, n, best, best * 1e9 / n))
+            sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline_file, threshold):
+    with open(baseline_file) as f:
+        baseline = {(r['name'], r['size']): r['seconds'] for r in json.load(f)}
+    regressions = 0
+    print('\n{:>28} {:>9} {:>12} {:>12} {:>8}'.format('name', 'size', 'baseline', 'now', 'ratio'))
+    for result in results:
+        before = baseline.get((result['name'], result['size']))
+        if not before:
+            continue
+        ratio = result['seconds'] / before
+        flag = ' <-- slower' if ratio > threshold else ''
+        regressions += 1 if flag else 0
+        print('{:>28} {:>9} {:>11.4f}s {:>11.4f}s {:>8.2f}{}'.format(
+            result['name'], result['size'], before, result['seconds'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the per record hot paths')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='comma separated benchmark names')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio over the baseline considered a regression')
+    args = parser.parse_args()
+
+    log_dir = use_temp_config()
+    selected = args.only.split(',') if args.only else None
+    results = run(selected, [int(n) for n in args.sizes.split(',')], args.repeat, log_dir)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
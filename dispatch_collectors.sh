@@ -1,24 +1,9 @@
 #!/bin/bash
 
-pids=()
+# All the collectors run in one process sharing the Zoom client, the connection
+# pool and the rate limit budget:
+#   past meetings every 10 minutes, live meetings every minute,
+#   live webinars every 2 minutes and past webinars every 15 minutes
 
-echo flask live-events --debug --meeting --past  --interval 10 
-flask live-events --debug --meeting --past  --interval 10 &
-pids[0]=$!
-sleep $((1 + $RANDOM % 120))
-echo flask live-events --debug --meeting   --interval 1 
-flask live-events --debug --meeting --interval 1 &
-pids[1]=$!
-sleep $((1 + $RANDOM % 120))
-echo flask live-events --debug  --interval 2
-flask live-events --debug   --interval 2 &
-pids[2]=$!
-sleep $((1 + $RANDOM % 120))
-echo flask live-events --debug  --past  --interval 15
-flask live-events --debug  --past  --interval 15 &
-pids[3]=$!
-
-# wait for all pids
-for pid in ${pids[*]}; do
-    wait $pid
-done
\ No newline at end of file
+echo flask collector-daemon --debug --meetings-past 10 --meetings-live 1 --webinars-live 2 --webinars-past 15
+exec flask collector-daemon --debug --meetings-past 10 --meetings-live 1 --webinars-live 2 --webinars-past 15
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+
+from utils.archive import ArchiveSink, ARCHIVED, available, compact, days_in, read
+
+logger = logging.getLogger('zoom-dashboard')
+
+
+def _report_participants_per_meeting(typeofevent, start_date, end_date):
+    sessions = defaultdict(int)
+    seconds = defaultdict(float)
+    for day, table in read('participants', typeofevent, ['uuid', 'duration'], start_date, end_date):
+        for uuid, duration in zip(table.column('uuid').to_pylist(), table.column('duration').to_pylist()):
+            sessions[uuid] += 1
+            seconds[uuid] += duration or 0
+    events = {}
+    for day, table in read('events', typeofevent, ['uuid', 'topic', 'host'], start_date, end_date):
+        for uuid, topic, host in zip(*[table.column(name).to_pylist() for name in ('uuid', 'topic', 'host')]):
+            events[uuid] = (topic, host)
+    rows = []
+    for uuid, count in sessions.items():
+        topic, host = events.get(uuid, (None, None))
+        rows.append((uuid, topic, host, count, int(seconds[uuid] / 60)))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return ('uuid', 'topic', 'host', 'participants', 'minutes'), rows
+
+
+def _report_minutes_per_day(typeofevent, start_date, end_date):
+    rows = []
+    for day, table in read('participants', typeofevent, ['duration'], start_date, end_date):
+        seconds = sum(duration for duration in table.column('duration').to_pylist() if duration)
+        rows.append((day, table.num_rows, int(seconds / 60)))
+    return ('day', 'participants', 'minutes'), rows
+
+
+def _report_top_hosts(typeofevent, start_date, end_date):
+    events = defaultdict(int)
+    participants = defaultdict(int)
+    seconds = defaultdict(int)
+    for day, table in read('events', typeofevent, ['host', 'participants', 'duration'], start_date, end_date):
+        columns = [table.column(name).to_pylist() for name in ('host', 'participants', 'duration')]
+        for host, count, duration in zip(*columns):
+            events[host] += 1
+            participants[host] += count or 0
+            seconds[host] += duration or 0
+    rows = [(host, events[host], participants[host], int(seconds[host] / 60)) for host in events]
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return ('host', 'events', 'participants', 'minutes'), rows
+
+
+REPORTS = {
+    'participants-per-meeting': _report_participants_per_meeting,
+    'minutes-per-day': _report_minutes_per_day,
+    'top-hosts': _report_top_hosts,
+}
+
+
+@click.command()
+@click.option("--report", help='Report to produce', type=click.Choice(sorted(REPORTS)), required=True)
+@click.option("--meeting", help='We are dealing with meetings', is_flag=True)
+@click.option("--start_date", help='First day of the report e.g. 2020-11-24')
+@click.option("--end_date", help='Last day of the report e.g. 2020-11-30')
+@click.option("--limit", help='Number of rows to print, 0 for all', type=int, default=20)
+@click.option("--json", "as_json", help='Print one json per row', is_flag=True)
+@with_appcontext
+def archive_query(report, meeting, start_date, end_date, limit, as_json):
+    """
+    Reports on the parquet archive of past events and participants, see live-events --archive
+    """
+    if not available():
+        raise click.UsageError("pyarrow is needed to read the archive")
+    header, rows = REPORTS[report]('meeting' if meeting else 'webinar', start_date, end_date)
+    if limit and report != 'minutes-per-day':
+        rows = rows[:limit]
+    if not as_json:
+        click.echo('\t'.join(header))
+    for row in rows:
+        if as_json:
+            click.echo(json.dumps(dict(zip(header, row))))
+        else:
+            click.echo('\t'.join('' if value is None else str(value) for value in row))
+
+
+@click.command()
+@click.argument("files", nargs=-1, required=True)
+@click.option("--batch", help='Records written per parquet part', type=int, default=10000)
+@with_appcontext
+def archive_import(files, batch):
+    """
+    Load past events and participants log files, rotated ones included, into the parquet archive.
+    Every partition is compacted afterwards, which drops the records that were already archived,
+    so a file can be loaded again, e.g. to recover what a collector lost in a crash.
+    """
+    if not available():
+        raise click.UsageError("pyarrow is needed to write the archive")
+    touched = set()
+    for path in files:
+        name = next((name for name in ARCHIVED if os.path.basename(path).startswith(name)), None)
+        if not name:
+            logger.warn("{} is not a log of the past collectors, skipped".format(path))
+            continue
+        sink = ArchiveSink(name, batch_rows=batch)
+        count = 0
+        with open(path, 'r') as f:
+            for line in f:
+                sink.write(json.loads(line))
+                count += 1
+                if count % batch == 0:
+                    sink.flush()
+        sink.close()
+        touched.add(ARCHIVED[name])
+        logger.info("{}: {} records archived".format(path, count))
+    for dataset, typeofevent in touched:
+        for day in days_in(dataset, typeofevent):
+            compact(dataset, typeofevent, day)
@@ -1,4 +1,6 @@
+import asyncio
 import datetime
+import json
 import logging
 import time
 import traceback
@@ -6,72 +8,137 @@ import traceback
 import requests
 import click
 
-from utils.helper import helper 
+from utils.helper import helper, LastWebinarIndex
+from utils import timeutil
+from utils.tracing import Tracer
 from flask.cli import with_appcontext
-from utils.zclient import ZoomAPIClient
+from utils.zclient import ZoomAPIClient, AsyncZoomAPIClient, iter_pages
 from utils.openid import Openid
 from config import ZOOM_BASE_URL, ZOOM_API_CLIENT, ZOOM_API_SECRET, KEYCLOAK_API_TOKEN_ENDPOINT, KEYCLOAK_ENDPOINT, AUTHZSVC_ENDPOINT, CLIENT_SECRET, CLIENT_ID, AUTHZ_ENDPOINT
 
 logger = logging.getLogger('zoom-dashboard')
 
 
+def _zoom_account(member, sub):
+    if sub:
+        return member['primaryAccountEmail']
+    return '{}@cernch'.format(member['upn'])
+
+
+def _plan_global_action(members1000, members500, keep1000, lastwebinar, days, sub, now):
+    """Compute the license changes as set operations on the upns of the group members
+
+    Args:
+        members1000 (list): members of the 1000 Webinar add-on group
+        members500 (list): members of the 500 Webinar add-on group
+        keep1000 (set): upns of the 1000 group that keep it e.g. with an upcoming 1000 attendees webinar,
+            they are never removed from the 500 group either
+        lastwebinar (dict): Zoom account: end time of its last webinar, whatever its age
+        days (int): number of days without webinars after which the 500 add-on is removed
+        sub (bool): Zoom subaccount
+        now (float): epoch to compare the last webinars with
+
+    Returns:
+        dict: upns to remove from the 1000 group, to add to the 500 group, to set the 500
+        add-on to and to remove from the 500 group
+    """
+    upns1000 = set(member['upn'] for member in members1000)
+    upns500 = set(member['upn'] for member in members500)
+    expired = set()
+    for member in members500:
+        # never used yet counts as used now
+        last = lastwebinar.get(_zoom_account(member, sub))
+        if last and (now - timeutil.parse_epoch(last)) // 86400 > days:
+            expired.add(member['upn'])
+    # an upcoming webinar is more recent than any past one
+    expired -= keep1000
+    downgrade = upns1000 - keep1000
+    return {
+        'remove1000': sorted(downgrade),
+        'add500': sorted(downgrade - upns500),
+        'set500': sorted((downgrade & upns500) - expired),
+        'remove500': sorted(expired),
+    }
+
+
+def _identities(openid, upns, members):
+    """Identity ids of some upns, from the member listing, asking for the ones missing there"""
+    ids = []
+    for upn in upns:
+        identity = members[upn].get('id') or openid.get_identity(upn)
+        if identity:
+            ids.append(identity)
+    return ids
+
+
+def _apply_global_action(openid, zoomapi, plan, members, groupid500, groupid1000, sub):
+    # the 500 add-on is granted before the 1000 one is revoked, so a failure in between
+    # leaves the downgraded accounts with both rather than none
+    if plan['add500']:
+        openid.add_ids_to_group(groupid500, _identities(openid, plan['add500'], members))
+        logger.debug("{} accounts added to group {}".format(len(plan['add500']), groupid500))
+    for upn in plan['set500']:
+        _set_zoom_webinar(_zoom_account(members[upn], sub), 500, zoomapi=zoomapi)
+    if plan['remove1000']:
+        openid.remove_ids_from_group(groupid1000, _identities(openid, plan['remove1000'], members))
+        logger.debug("{} accounts removed from group {}".format(len(plan['remove1000']), groupid1000))
+    if plan['remove500']:
+        openid.remove_ids_from_group(groupid500, _identities(openid, plan['remove500'], members))
+        logger.debug("{} accounts removed from group {}".format(len(plan['remove500']), groupid500))
+    for upn in plan['remove500']:
+        _set_zoom_webinar(_zoom_account(members[upn], sub), 0, zoomapi=zoomapi)
+
+
 @click.command()
 @click.option("--sub", help='It is Zoom subaccount', is_flag=True)
 @click.option("--group500", help='people with 500 Webinar add-on')
 @click.option("--group1000", help='people with 1000 Webinar add-on')
 @click.option("--days", help='number of days to be removed from license owner', type=int, default=30)
+@click.option("--dry", help='Just output the plan without doing it', is_flag=True)
+@click.option("--concurrency", help='Number of users whose webinars are checked at once', type=int, default=8)
+@click.option("--trace", help='Write the timing spans of the stages to zoom-trace.log', is_flag=True)
+@click.option("--profile", help='Dump a cProfile of the run and log its tracemalloc growth', is_flag=True)
 @with_appcontext
-def global_action(sub, group500, group1000, days):
+def global_action(sub, group500, group1000, days, dry, concurrency, trace, profile):
+    """
+    Move the 1000 Webinar add-on owners without an upcoming 1000 attendees webinar to the 500 add-on,
+    and remove the 500 add-on from the ones without webinars in the last days
+    """
+    tracer = Tracer('global-action', trace=trace, profile_every=1 if profile else 0)
+    with tracer.iteration(dry=dry) as span:
+        openid = Openid()
+        with tracer.stage('members'):
+            groupid500=openid.get_group_id(group500)
+            logger.info('{} id is: {}'.format(group500, groupid500))
+            groupid1000=openid.get_group_id(group1000)
+            logger.info('{} id is: {}'.format(group1000, groupid1000))
 
-    openid = Openid()
-    groupid500=openid.get_group_id(group500)
-    logger.info('{} id is: {}'.format(group500, groupid500))
-    groupid1000=openid.get_group_id(group1000)
-    logger.info('{} id is: {}'.format(group1000, groupid1000))
-
-    members1000=[]
-    openid.get_allmembers(groupid1000, members1000, fields=['primaryAccountEmail','upn'])
-    members500=[]
-    openid.get_allmembers(groupid500, members500, fields=['primaryAccountEmail','upn'])
-
-    for member in members1000:
-        print(member)
-        zaccount='{}@cernch'.format(member['upn'])
-        if sub:
-            zaccount=member['primaryAccountEmail']
-        try: 
-            if _list_webinars(zaccount):
-                continue
-        except requests.exceptions.HTTPError as ex:
-            logger.debug("Could not retrieve webinars for {} exception: {}".format(zaccount, ex))
-            continue
-    
-        #remove from group 1000 and add to 500
-        logger.debug('{} needs to be removed from: {}'.format(member['upn'], group1000))
-       
-        account_id=openid.get_identity(member['upn'])
-        if next((item for item in members1000 if item['upn'] == member['upn']), None):
-            openid.remove_id_from_group(groupid1000, account_id)
-            logger.debug("{} account removed from group {}".format(member['upn'], group1000))
-        if not next((item for item in members500 if item['upn'] == member['upn']), None):
-            openid.add_id_to_group(groupid500,account_id)
-            logger.debug("{} account added to group {}".format(member['upn'], group500))
+            groups=openid.get_groups_members([groupid1000, groupid500], fields=['primaryAccountEmail','upn','id'])
+            members1000=groups[groupid1000]
+            members500=groups[groupid500]
+            members={member['upn']: member for member in members500 + members1000}
+        span.update(members1000=len(members1000), members500=len(members500))
+
+        zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL, pool_size=max(10, concurrency))
+        with tracer.stage('licenses'):
+            checked=_check_webinar_licenses([_zoom_account(member, sub) for member in members1000], zoomapi, concurrency)
+        # the ones that could not be checked keep their add-on
+        keep1000=set(member['upn'] for member in members1000 if checked[_zoom_account(member, sub)] is not False)
+
+        with tracer.stage('lastwebinar'):
+            # every host of the index, one last active a year ago is not one that never was
+            lastwebinar=_last_zoom_webinar('past', 6, all_hosts=True)
+        with tracer.stage('plan'):
+            plan=_plan_global_action(members1000, members500, keep1000, lastwebinar, days, sub, timeutil.now())
+        logger.info("plan: {}".format({action: len(upns) for action, upns in plan.items()}))
+        span.update({action: len(upns) for action, upns in plan.items()})
+        if dry:
+            print(json.dumps(plan, indent=2))
         else:
-            logger.debug("{} already a member of group {}".format(member['upn'], group500))
-            _set_zoom_webinar(zaccount, 500)
-    
-    lastwebinar=_last_zoom_webinar('past', 6)
-    for member in members500:
-        zaccount='{}@cernch'.format(member['upn'])
-        if sub:
-            zaccount=member['primaryAccountEmail']
-        if (datetime.datetime.now() - datetime.datetime.strptime(lastwebinar.get('zaccount', datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")) , "%Y-%m-%dT%H:%M:%SZ")).days > days:
-            account_id=openid.get_identity(member['upn'])
-            logger.debug("UPN: {} identity: {}".format(member['upn'], account_id))
-            openid.remove_id_from_group(groupid500, account_id)
-            logger.debug("{} account removed from group {}".format(member['upn'], group500))
-            # change webinar add-on
-            _set_zoom_webinar(zaccount, 0)
+            with tracer.stage('apply'):
+                _apply_global_action(openid, zoomapi, plan, members, groupid500, groupid1000, sub)
+        openid.close()
+    tracer.close()
 
 
 @click.command()
@@ -96,6 +163,7 @@ def get_members_add_member(group, account):
             logger.debug("{} account added to group {}".format(account_parts[0], group))
         else:
             logger.debug("{} already a member of group {}".format(account_parts[0], group))
+    openid.close()
     
 
 @click.command()
@@ -106,16 +174,79 @@ def list_webinars(user):
 
     return _list_webinars(user)
 
-def _list_webinars(user):
-    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
+def _is_1000_webinar(item):
+    return '1000attendees' in item.get('agenda', '') or '1000attendees' in item.get('topic', '')
+
+
+async def _ahas_1000_webinar(zoom, user, details):
+    """
+    Whether a user has an upcoming 1000 attendees webinar, same as _list_webinars with a AsyncZoomAPIClient.
+    The single webinars are looked at before the recurring ones, whose details are only retrieved
+    if they are 1000 attendees ones and until one has an upcoming occurrence.
+
+    Args:
+        details (dict): webinar id: details of the recurring webinars already retrieved in this run
+    """
+    ret = await zoom.list_user_webinars(page_size=300, id=user)
+    now = timeutil.now()
+    webinars = ret['webinars']
+    for item in webinars:
+        if item['type'] == 5 and timeutil.parse_epoch(item['start_time']) > now and _is_1000_webinar(item):
+            return True
+    for item in webinars:
+        if item['type'] != 9 or not _is_1000_webinar(item):
+            continue
+        if item['id'] not in details:
+            details[item['id']] = await zoom.get_webinar_details(webinarid=item['id'])
+        for oc in details[item['id']].get('occurrences') or []:
+            if timeutil.parse_epoch(oc['start_time']) > now:
+                return True
+    return False
+
+
+def _check_webinar_licenses(users, zoomapi, concurrency=8):
+    """
+    Check which users have an upcoming 1000 attendees webinar, concurrency of them at once,
+    sharing the client, its connections and its rate limit budget.
+
+    Returns:
+        dict: user: True or False, None if it could not be checked
+    """
+    zoom = AsyncZoomAPIClient.from_client(zoomapi, concurrency=concurrency)
+    loop = asyncio.new_event_loop()
+    details = {}
+
+    async def check(user):
+        try:
+            return await _ahas_1000_webinar(zoom, user, details)
+        except requests.exceptions.RequestException as ex:
+            logger.debug("Could not retrieve webinars for {} exception: {}".format(user, ex))
+            return None
+
+    async def gather():
+        return await asyncio.gather(*[check(user) for user in users])
+    try:
+        results = dict(zip(users, loop.run_until_complete(gather())))
+    finally:
+        zoom.close()
+        loop.close()
+    logger.info("{} users checked, {} with an upcoming 1000 attendees webinar, {} recurring webinars retrieved".format(
+        len(users), sum(1 for result in results.values() if result), len(details)))
+    return results
+
+
+def _list_webinars(user, zoomapi=None):
+    if not zoomapi:
+        zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
     data = {
         'page_size': 300,
         'id': user
     }
     ret = zoomapi.list_user_webinars(**data)
+    now = timeutil.now()
     for item in ret['webinars']:
         print(item)
-        if item['type'] == 5  and datetime.datetime.strptime(item['start_time'], "%Y-%m-%dT%H:%M:%SZ") > datetime.datetime.now():
+        if item['type'] == 5  and timeutil.parse_epoch(item['start_time']) > now:
             print('got here')
             if ('1000attendees' in item.get('agenda', '') or '1000attendees' in item.get('topic', '')):
                 print(item)  
@@ -123,7 +254,7 @@ def _list_webinars(user):
         elif item['type'] == 9:
             webinarobj = zoomapi.get_webinar_details(**{'webinarid': item['id']})
             for oc in webinarobj.get('occurrences', None):
-                if datetime.datetime.strptime(oc['start_time'], "%Y-%m-%dT%H:%M:%SZ") > datetime.datetime.now() and \
+                if timeutil.parse_epoch(oc['start_time']) > now and \
                     ('1000attendees' in item.get('agenda', '') or '1000attendees' in item.get('topic', '')):
                     print(webinarobj)
                     return True               
@@ -133,13 +264,65 @@ def _list_webinars(user):
 @click.command()
 @click.option("--past", help='if present its about past webinars', is_flag=True)
 @click.option("--interval", help='number of months', type=int)
+@click.option("--trace", help='Write the timing spans of the run to zoom-trace.log', is_flag=True)
+@click.option("--profile", help='Dump a cProfile of the run and log its tracemalloc growth', is_flag=True)
 @with_appcontext
-def last_zoom_webinar(past, interval):
+def last_zoom_webinar(past, interval, trace, profile):
     logger.info("Starting script")
-    return _last_zoom_webinar(past,interval)
-    
+    tracer = Tracer('last-zoom-webinar', trace=trace, profile_every=1 if profile else 0)
+    with tracer.iteration(past=past) as span:
+        with tracer.stage('fetch'):
+            lastwebinar = _last_zoom_webinar(past,interval)
+        span.update(hosts=len(lastwebinar))
+    tracer.close()
+    print(lastwebinar)
+    return lastwebinar
 
-def _last_zoom_webinar(past, interval):
+
+@click.command()
+@click.option("--interval", help='number of months', type=int, default=6)
+@click.option("--trace", help='Write the timing spans of the stages to zoom-trace.log', is_flag=True)
+@click.option("--profile", help='Dump a cProfile of the run and log its tracemalloc growth', is_flag=True)
+@with_appcontext
+def backfill_last_webinar(interval, trace, profile):
+    """
+    Fill the last webinar per host index from the past webinars of the last months,
+    afterwards the past webinars collector keeps it up to date
+    """
+    logger.info("Starting script")
+    tracer = Tracer('backfill-last-webinar', trace=trace, profile_every=1 if profile else 0)
+    with tracer.iteration() as span:
+        index = LastWebinarIndex()
+        with tracer.stage('fetch'):
+            lastwebinar = _fetch_last_zoom_webinar(True, interval)
+        with tracer.stage('write'):
+            index.update(lastwebinar)
+            index.commit()
+        span.update(hosts=len(index))
+        logger.info("{} hosts in the last webinar index".format(len(index)))
+        index.close()
+    tracer.close()
+
+
+def _last_zoom_webinar(past, interval, all_hosts=False):
+    """
+    Last webinar end_time of every host, for past ones from the index kept by the past webinars
+    collector, which is backfilled if it is empty. Only the hosts with a webinar in the last
+    interval months, unless all_hosts.
+    """
+    if not past:
+        return _fetch_last_zoom_webinar(past, interval)
+    index = LastWebinarIndex()
+    if len(index) == 0:
+        logger.info("Last webinar index is empty, backfilling it")
+        index.update(_fetch_last_zoom_webinar(past, interval))
+        index.commit()
+    lastwebinar = index.load(days=None if all_hosts else interval * 30)
+    index.close()
+    return lastwebinar
+
+
+def _fetch_last_zoom_webinar(past, interval):
     zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
 
     lastwebinar={}
@@ -170,13 +353,11 @@ def _last_zoom_webinar(past, interval):
             print(item)
             if 'end_time' in item.keys():
                 if item['email'] in lastwebinar.keys():
-                    if datetime.datetime.strptime(item["end_time"], "%Y-%m-%dT%H:%M:%SZ") > \
-                    datetime.datetime.strptime(lastwebinar[item['email']], "%Y-%m-%dT%H:%M:%SZ"):
+                    if timeutil.parse_epoch(item["end_time"]) > timeutil.parse_epoch(lastwebinar[item['email']]):
                         lastwebinar[item['email']] = item['end_time']
                 else:
                     lastwebinar[item['email']] = item['end_time']
         logger.info("total number of entries retrieved from: to: value: {}".format(data['from'], data['to'],len(ret)))
-    print(lastwebinar)
     return  lastwebinar
 
 def _get_live_events(zoom, data):
@@ -185,18 +366,8 @@ def _get_live_events(zoom, data):
     """
     events = []
     try: 
-        res=zoom.list_webinars(**data)
-        events = res["webinars"]
-        counter = 1
-        while res["next_page_token"] != '':
-            if counter > 9:
-                counter = 1
-                time.sleep(120)
-                logger.warn("We need to go sleep as going above 10 calls")
-            data["next_page_token"] = res["next_page_token"]
-            res = zoom.list_webinars(**data)
-            events.extend(res["webinars"])
-            counter += 1
+        for page in iter_pages(zoom.list_webinars, "webinars", **data):
+            events.extend(page)
     except requests.exceptions.HTTPError as ex: 
         logger.error(ex)
         time.sleep(60)
@@ -223,8 +394,9 @@ def set_zoom_webinar(account, capacity):
     
     
 
-def _set_zoom_webinar(account, capacity):
-    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
+def _set_zoom_webinar(account, capacity, zoomapi=None):
+    if not zoomapi:
+        zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
     logger.info("working with account: <{}>".format(account))
     data = {}
     if capacity > 0 and capacity in [500, 1000]:
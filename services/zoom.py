@@ -1,50 +1,49 @@
+import asyncio
+import csv
 import datetime
 import logging
 import time
 import json
 import re
+import signal
+import threading
 import traceback
 
 import requests
 import click
-from utils.helper import helper 
+from utils.helper import helper, DedupIndex, TimeBucketDedup, LastWebinarIndex, Checkpoint
+from utils import timeutil
+from utils.outputs import sink_factory, write_pages, STREAM_FORMATS
+from utils.archive import available as archive_available
+from utils.livedelta import LiveDelta
+from utils import livestore, metrics
+from utils.tracing import Tracer, NULL_TRACER
+from utils.aggregation import LiveAggregator, Rollups
+from flask import current_app
 from flask.cli import with_appcontext
-from utils.zclient import ZoomAPIClient
+from werkzeug.serving import make_server
+from utils.zclient import ZoomAPIClient, AsyncZoomAPIClient, iter_pages, aiter_pages
 from config import ZOOM_BASE_URL, ZOOM_API_CLIENT, ZOOM_API_SECRET
 
 logger = logging.getLogger('zoom-dashboard')
 
+def _iter_live_events(zoom, meeting, data):
+    """
+    Iterate over the pages of events, as they arrive
+    """
+    if meeting:
+        return iter_pages(zoom.list_meetings, "meetings", **data)
+    return iter_pages(zoom.list_webinars, "webinars", **data)
+
+
 def _get_live_events(zoom, meeting, data):
     """
     Iteration to retrieve all events
     """
     events = []
     try: 
-        if meeting:
-            res = zoom.list_meetings(**data)
-            events = res["meetings"]
-            counter = 1
-            while res["next_page_token"] != '':
-                if counter > 9:
-                    counter = 1
-                    time.sleep(60)
-                data["next_page_token"] = res["next_page_token"]
-                res = zoom.list_meetings(**data)
-                events.extend(res["meetings"])
-                counter += 1
-        else:
-            res=zoom.list_webinars(**data)
-            events = res["webinars"]
-            counter = 1
-            while res["next_page_token"] != '':
-                if counter > 9:
-                    counter = 1
-                    time.sleep(120)
-                    logger.warn("We need to go sleep as going above 10 calls")
-                data["next_page_token"] = res["next_page_token"]
-                res = zoom.list_webinars(**data)
-                events.extend(res["webinars"])
-                counter += 1
+        for page in _iter_live_events(zoom, meeting, data):
+            events.extend(page)
     except requests.exceptions.HTTPError as ex: 
         logger.error(ex)
         time.sleep(60)
@@ -56,53 +55,140 @@ def _get_live_events(zoom, meeting, data):
     return events
 
 
-@click.command()
-@click.option("--debug", help='Do some command line printing', is_flag=True)
-@click.option("--meeting", help='We are dealing with meetings', is_flag=True)
-@click.option("--interval", help='In minutes to iterate', type=int, default=0)
-@click.option("--start_date", help='Start date for the report, it always considers just a day e.g. 2020-11-24')
-@click.option("--past", help='In case we are interested in past events', is_flag=True)
-@with_appcontext
-def live_events(meeting, interval, past, start_date, debug):
+def _live_record(item, meeting):
+    return {
+        "type": 'meeting' if meeting else 'webinar',
+        "participants": item["participants"],
+        "uuid": item["uuid"],
+        "zoomid": item["id"],
+        "topic": item["topic"],
+        "has_pstn": 1 if item['has_pstn'] else 0,
+        "has_voip": 1 if item['has_voip'] else 0,
+        "has_3partyaudio": 1 if item['has_3rd_party_audio'] else 0,
+        "has_screenshare": 1 if item['has_screen_share'] else 0,
+        "has_recording": 1 if item['has_recording'] else 0,
+        "has_sip": 1 if item['has_sip'] else 0,
+        "has_video": 1 if item['has_video'] else 0,
+        "start_time": timeutil.now_iso()
+    }
+
+
+def _normalize_participant(participant, item, meeting):
     """
-    Command to retrieve events and participants from Zoom 
+    Add to a participant the event it belongs to and its duration in seconds
     """
-    logger.info("Starting script")
-    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
-    typeofevent = 'live'
-    if past:
-        typeofevent = 'past'
-    data = {
-        'type': typeofevent,
-        'page_size': 300
-    }
-    
-    logger2 = None
-    logger3 = None
-    arrids = []
-    arrparticipants = []
-    if meeting and not past:
-        logger2 = helper.getFileLogger("zoom-meetings-live.log", "meeting-live")
-    elif meeting:
-        logger2 = helper.getFileLogger("zoom-meetings-past.log", 'meeting-past')
-        arrids = helper.readFileArray("zoom-meetings-past.log")
-        logger3 = helper.getFileLogger("zoom-meetings-pasticipants.log", 'meeting-participants-past')
-        arrparticipants = helper.readFileArray("zoom-meetings-pasticipants.log")
-    elif not meeting and not past:
-        logger2 = helper.getFileLogger("zoom-webinars-live.log", "webinar-live")   
+    participant['uuid'] = item['uuid']
+    if 'zoomid' in item:
+        participant['zoomid'] = item['zoomid']
+    else: 
+        participant['zoomid'] = item['id']
+    if 'id' not in participant:
+        participant['participantid'] = None
+    else:    
+        participant['participantid'] = participant.pop('id')
+    if meeting:
+        participant['meeting'] = 1
     else:
-        logger2 = helper.getFileLogger("zoom-webinars-past.log", 'webinar-past')
-        arrids = helper.readFileArray("zoom-webinars-past.log")
-        logger3 = helper.getFileLogger("zoom-webinars-pasticipants.log", 'webinar-participants-past')
-        arrparticipants = helper.readFileArray("zoom-webinars-pasticipants.log")
+        participant['webinar'] =1    
+    if "join_time" in participant and "leave_time" in participant:
+        participant['duration'] = float(timeutil.parse_epoch(participant["leave_time"]) - \
+            timeutil.parse_epoch(participant["join_time"]))
+    return participant
 
-    while True:
-        if start_date:
-            if re.match(r'\d{4}-\d{2}-\d{2}', start_date):
-                data["from"] = start_date
-                data["to"] = start_date
+
+class EventCollector(object):
+    """
+    One of the collectors of live_events: meetings or webinars, live or past.
+
+    It keeps its loggers and dedup state between iterations, so several of them can
+    share a ZoomAPIClient in one process, see collector_daemon.
+
+    Args:
+        zoomapi (ZoomAPIClient): client to use, it can be shared with other collectors
+        meeting (bool): meetings if True, otherwise webinars
+        past (bool): past events and their participants if True, otherwise live events
+        start_date (str): fixed day to report on e.g. 2020-11-24, otherwise today
+        debug (bool): do some more logging
+        concurrency (int): number of past events to retrieve participants from at once
+        delta (bool): live records only written when they change, see LiveDelta
+        keyframe (int): in minutes, with delta, write records at least this often
+        interval (int): in minutes, how often run_once is called, for the live rollups
+        flush_interval (float): seconds records can be buffered before being written, see RecordWriter
+        fsync_interval (float): seconds between fsync of the log files, 0 to leave it to the OS
+        outputs (function): log file name -> output of its records, see utils.outputs.sink_factory,
+            by default the log files with flush_interval and fsync_interval
+        store (LiveStore): where the live collectors publish their latest snapshot, see utils.livestore
+        trace (bool): write the timing spans of the stages of every iteration, see utils.tracing
+        profile (int): profile every so many iterations, with cProfile and tracemalloc, 0 to never
+    """
+
+    def __init__(self, zoomapi, meeting, past, start_date=None, debug=False, concurrency=1, delta=False, keyframe=15,
+                 interval=1, flush_interval=1.0, fsync_interval=0, outputs=None, store=None, trace=False, profile=0):
+        self.zoomapi = zoomapi
+        self.meeting = meeting
+        self.past = past
+        self.start_date = start_date
+        self.debug = debug
+        self.interval = interval
+        self.store = store if not past else None
+        self.azoomapi = None
+        self.loop = None
+        if past and concurrency > 1:
+            self.azoomapi = AsyncZoomAPIClient.from_client(zoomapi, concurrency=concurrency)
+            self.loop = asyncio.new_event_loop()
+        self.delta = LiveDelta(keyframe * 60) if delta and not past else None
+        self.rollups = None
+        self.rollupswriter = None
+        if outputs is None:
+            outputs = sink_factory(flush_interval=flush_interval, fsync_interval=fsync_interval)
+        self.data = {
+            'type': 'past' if past else 'live',
+            'page_size': 300
+        }
+
+        self.participantswriter = None
+        self.lastwebinar = None
+        self.arrids = None
+        self.arrparticipants = None
+        if meeting and not past:
+            self.writer = outputs("zoom-meetings-live.log")
+            self.rollupswriter = outputs("zoom-meetings-rollup.log")
+        elif meeting:
+            self.writer = outputs("zoom-meetings-past.log")
+            self.idsindex = DedupIndex("zoom-meetings-past.log")
+            self.participantswriter = outputs("zoom-meetings-pasticipants.log")
+            self.participantsindex = DedupIndex("zoom-meetings-pasticipants.log")
+        elif not meeting and not past:
+            self.writer = outputs("zoom-webinars-live.log")
+            self.rollupswriter = outputs("zoom-webinars-rollup.log")
+        else:
+            self.writer = outputs("zoom-webinars-past.log")
+            self.idsindex = DedupIndex("zoom-webinars-past.log")
+            self.participantswriter = outputs("zoom-webinars-pasticipants.log")
+            self.participantsindex = DedupIndex("zoom-webinars-pasticipants.log")
+            self.lastwebinar = LastWebinarIndex()
+        if not past:
+            self.rollups = Rollups(meeting, interval=interval)
         else:
-            if past:
+            self.arrids = TimeBucketDedup()
+            self.arrids.update(self.idsindex.load())
+            self.arrparticipants = TimeBucketDedup()
+            self.arrparticipants.update(self.participantsindex.load())
+        metrics.INTERVAL.set(interval * 60, collector=self.name)
+        self.tracer = Tracer(self.name, trace=trace, profile_every=profile) if trace or profile else NULL_TRACER
+
+    @property
+    def name(self):
+        return '{}-{}'.format('meetings' if self.meeting else 'webinars', 'past' if self.past else 'live')
+
+    def _query(self):
+        data = self.data
+        if self.start_date:
+            if re.match(r'\d{4}-\d{2}-\d{2}', self.start_date):
+                data["from"] = self.start_date
+                data["to"] = self.start_date
+        else:
+            if self.past:
                 data["from"] = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%Y-%m-%d") 
             else:
                 check = datetime.datetime.now()
@@ -113,117 +199,346 @@ def live_events(meeting, interval, past, start_date, debug):
                 else:    
                     data["from"] = datetime.date.today().strftime("%Y-%m-%d") 
             data["to"] = datetime.date.today().strftime("%Y-%m-%d")
-        
-        if debug: logger.debug(data)
-        time.sleep(interval * 60)
-        ret = _get_live_events(zoomapi, meeting, data=data.copy())
-        if ret == None:
-            logger.warn("No values return in this iteration. HTTP Exception")
-            continue
-        if len(ret)==0 and interval > 0:
+        return data.copy()
+
+    def run_once(self, skip_empty=False):
+        """
+        One iteration: retrieve the events and write them and their participants
+
+        Args:
+            skip_empty (bool): do not write the live summary if there are no events
+
+        Returns:
+            bool: False if the iteration failed, e.g. an HTTP exception
+        """
+        started = time.time()
+        ok = True
+        with timeutil.frozen_now(), self.tracer.iteration() as span:
+            data = self._query()
+            if self.debug: logger.debug(data)
+            try:
+                if not self.past:
+                    self._collect_live(data, skip_empty)
+                else:
+                    self._collect_past(data)
+                    span.update(events=len(self.arrids), participants=len(self.arrparticipants))
+            except requests.exceptions.HTTPError as ex: 
+                logger.error(ex)
+                logger.warn("No values return in this iteration. HTTP Exception")
+                ok = False
+            except:
+                logger.error("Unexpected exception: {}".format(traceback.format_exc()))  
+                ok = False
+            # what was collected is written even if the iteration failed half way
+            try:
+                with self.tracer.stage('write'):
+                    self._flush()
+            except Exception:
+                # e.g. sqlite busy committing a dedup index, or the archive disk full
+                logger.error("{} could not flush its outputs: {}".format(self.name, traceback.format_exc()))
+                ok = False
+            if not ok:
+                metrics.FAILURES.inc(collector=self.name)
+            self._observe(time.time() - started)
+        return ok
+
+    def _observe(self, elapsed):
+        # where the time goes and how big the dedup state gets, see utils.metrics
+        metrics.ITERATION_SECONDS.observe(elapsed, collector=self.name)
+        metrics.LAST_ITERATION.set(elapsed, collector=self.name)
+        if elapsed > self.interval * 60:
+            metrics.OVERRUNS.inc(collector=self.name)
+        if self.past:
+            metrics.DEDUP_ENTRIES.set(len(self.arrids), collector=self.name, map='events')
+            metrics.DEDUP_ENTRIES.set(len(self.arrparticipants), collector=self.name, map='participants')
+        elif self.delta is not None:
+            metrics.DEDUP_ENTRIES.set(len(self.delta), collector=self.name, map='live')
+
+    def _writers(self):
+        return [writer for writer in (self.writer, self.participantswriter, self.rollupswriter) if writer]
+
+    def _flush(self):
+        # the dedup indexes only get what is already in the log files
+        for writer in self._writers():
+            writer.flush()
+        if self.past:
+            self.idsindex.commit()
+            self.participantsindex.commit()
+        if self.lastwebinar is not None:
+            self.lastwebinar.commit()
+
+    def _collect_live(self, data, skip_empty):
+        meeting = self.meeting
+        delta = self.delta
+        if delta is not None:
+            delta.start()
+        aggregator = LiveAggregator(meeting)
+        records = [] if self.store is not None else None
+        tracer = self.tracer
+        for page in tracer.iterate('fetch', _iter_live_events(self.zoomapi, meeting, data)):
+            with tracer.stage('aggregate'):
+                aggregator.add(page)
+            with tracer.stage('dedup'):
+                for item in page: 
+                    if item["participants"] == 1 and not (delta is not None and delta.known(item["uuid"])):
+                        continue
+                    livejson = _live_record(item, meeting)
+                    if records is not None:
+                        records.append(livejson)
+                    if delta is not None and not delta.changed(livejson):
+                        continue
+                    self.writer.write(livejson)
+                    if self.debug:
+                        logger.info("Event {} : {}".format('meeting' if meeting else 'webinar', livejson))   
+        if delta is not None:
+            with tracer.stage('dedup'):
+                for livejson in delta.ended(timeutil.now_iso()):
+                    self.writer.write(livejson)
+        summary = aggregator.summary(timeutil.now_iso())
+        if self.store is not None:
+            self.store.publish('meetings' if meeting else 'webinars', summary, records)
+        if aggregator.events == 0 and skip_empty:
             logger.info("No values return in this iteration")
-            continue
-        if not past:
-            sumparticipants = sum(item["participants"] for item in ret)
-            sumpstn = sum( 1 for item in ret if item['has_pstn'])
-            sumvoip = sum( 1 for item in ret if item['has_voip'])
-            sum3partyaudio= sum( 1 for item in ret if item['has_3rd_party_audio'])
-            sumvideo = sum( 1 for item in ret if item['has_video'])
-            sumscreenshare = sum( 1 for item in ret if item['has_screen_share'])
-            sumrecording = sum( 1 for item in ret if item['has_recording'])
-            sumsip = sum( 1 for item in ret if item['has_sip'])
-            sumvideo = sum( item["in_room_participants"] for item in ret if 'in_room_participants' in item)
-            livejson = {
-                "type": 'meeting' if meeting else 'webinar',
-                "events": len(ret),
-                "sumparticipants": sumparticipants,
-                "sumpstn": sumpstn,
-                "sumvoip": sumvoip,
-                "sum3partyaudio": sum3partyaudio,
-                "sumscreenshare": sumscreenshare,
-                "sumrecording": sumrecording,
-                "sumsip": sumsip,
-                "sumvideo": sumvideo,
-                "start_time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            }
-            logger2.info(json.dumps(livejson))
-            if debug:
-                logger.info("Event: {} : {}".format('meeting' if meeting else 'webinar', livejson))
-            
-            for item in ret: 
-                if item["participants"] == 1:
-                    continue
-                livejson = {
-                    "type": 'meeting' if meeting else 'webinar',
-                    "participants": item["participants"],
-                    "uuid": item["uuid"],
-                    "zoomid": item["id"],
-                    "topic": item["topic"],
-                    "has_pstn": 1 if item['has_pstn'] else 0,
-                    "has_voip": 1 if item['has_voip'] else 0,
-                    "has_3partyaudio": 1 if item['has_3rd_party_audio'] else 0,
-                    "has_screenshare": 1 if item['has_screen_share'] else 0,
-                    "has_recording": 1 if item['has_recording'] else 0,
-                    "has_sip": 1 if item['has_sip'] else 0,
-                    "has_video": 1 if item['has_video'] else 0,
-                    "start_time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-                }
-                logger2.info(json.dumps(livejson))
-                if debug:
-                    logger.info("Event {} : {}".format('meeting' if meeting else 'webinar', livejson))   
-        else:
-            if debug:
-                logger.debug("length of elements in array: {}".format(len(arrids)))
-            if not start_date:
-                arrids = helper.cleanArr(arrids) 
-                arrparticipants = helper.cleanArr(arrparticipants)
-            if debug:
-                logger.debug("length of elements in array after cleanup: {}".format(len(arrids)))
-
-            for item in ret:
-                if 'duration' in item:
-                    item['duration'] = helper.convertStrToSec(item['duration'])
-                if item['uuid'] not in arrids:
-                    if meeting:
-                        item['meeting'] = 1
-                    else:
-                        item['webinar'] = 1    
-                    item['zoomid'] = item.pop('id')  
-                    logger2.info(json.dumps(item))
-                    arrids[item['uuid']] = item['start_time']
-                    if debug:
-                        logger.info("{} added to meetings".format(item['uuid']))
-                        logger.info(json.dumps(item))
-                if item['uuid'] not in arrparticipants and helper.timeDiffinMinutes(item['end_time']) >= 180:
-                    ret2 = _get_past_participants_simplified(zoomapi, meeting, item['uuid'])
+            return
+        self.writer.write(summary)
+        with tracer.stage('aggregate'):
+            for rollup in self.rollups.add(aggregator):
+                self.rollupswriter.write(rollup)
+        if self.debug:
+            logger.info("Event: {} : {}".format('meeting' if meeting else 'webinar', summary))
+
+    def _collect_past(self, data):
+        meeting = self.meeting
+        arrids = self.arrids
+        arrparticipants = self.arrparticipants
+        tracer = self.tracer
+        if self.debug:
+            logger.debug("length of elements in array: {}".format(len(arrids)))
+        if not self.start_date:
+            with tracer.stage('dedup'):
+                arrids.expire()
+                arrparticipants.expire()
+        if self.debug:
+            logger.debug("length of elements in array after cleanup: {}".format(len(arrids)))
+
+        for page in tracer.iterate('fetch', _iter_live_events(self.zoomapi, meeting, data)):
+            pending = []
+            with tracer.stage('dedup'):
+                for item in page:
+                    if 'duration' in item:
+                        item['duration'] = helper.convertStrToSec(item['duration'])
+                    if item['uuid'] not in arrids:
+                        if meeting:
+                            item['meeting'] = 1
+                        else:
+                            item['webinar'] = 1    
+                        item['zoomid'] = item.pop('id')  
+                        self.writer.write(item)
+                        arrids.add(item['uuid'], item['start_time'])
+                        self.idsindex.add(item['uuid'], item['start_time'])
+                        if self.lastwebinar is not None and item.get('email') and item.get('end_time'):
+                            self.lastwebinar.add(item['email'], item['end_time'])
+                        if self.debug:
+                            logger.info("{} added to meetings".format(item['uuid']))
+                            logger.info(json.dumps(item))
+                    if item['uuid'] not in arrparticipants and helper.timeDiffinMinutes(item['end_time']) >= 180:
+                        pending.append(item)
+            with tracer.stage('participants'):
+                if self.azoomapi:
+                    participants = _get_past_participants_concurrently(self.azoomapi, self.loop, meeting, pending)
+                else:
+                    participants = [_get_past_participants_simplified(self.zoomapi, meeting, item['uuid']) for item in pending]
+            with tracer.stage('write'):
+                for item, ret2 in zip(pending, participants):
                     if ret2 == None:
                         logger.warn("No values return in this iteration for participants for uuid: {}".format(item['uuid']))
                         continue
                     for participant in ret2:
-                        participant['uuid'] = item['uuid']
-                        if 'zoomid' in item:
-                            participant['zoomid'] = item['zoomid']
-                        else: 
-                            participant['zoomid'] = item['id']
-                        if 'id' not in participant:
-                            participant['participantid'] = None
-                        else:    
-                            participant['participantid'] = participant.pop('id')
-                        if meeting:
-                            participant['meeting'] = 1
-                        else:
-                            participant['webinar'] =1    
-                        if "join_time" in participant and "leave_time" in participant:
-                            participant['duration'] = (datetime.datetime.strptime(participant["leave_time"], "%Y-%m-%dT%H:%M:%SZ") - \
-                                datetime.datetime.strptime(participant["join_time"], "%Y-%m-%dT%H:%M:%SZ")).total_seconds()
-                        logger3.info(json.dumps(participant))
-                    arrparticipants[item['uuid']] = item['start_time']
-                    if debug:
+                        self.participantswriter.write(_normalize_participant(participant, item, meeting))
+                    arrparticipants.add(item['uuid'], item['start_time'])
+                    self.participantsindex.add(item['uuid'], item['start_time'])
+                    if self.debug:
                         logger.info("{} added to participants".format(item['uuid']))
+                self._flush()
+
+    def close(self):
+        if self.rollups:
+            for rollup in self.rollups.flush():
+                self.rollupswriter.write(rollup)
+        for writer in self._writers():
+            writer.close()
+        if self.past:
+            self.idsindex.close()
+            self.participantsindex.close()
+        if self.lastwebinar is not None:
+            self.lastwebinar.close()
+        if self.azoomapi:
+            self.azoomapi.close()
+            self.loop.close()
+        self.tracer.close()
+
+
+def _serve(address):
+    """
+    Serve the flask app, and so the live api, from a thread of this process
+
+    Args:
+        address (str): host:port e.g. 127.0.0.1:8080
+    """
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise click.BadParameter("{} is not host:port".format(address), param_hint='--serve')
+    server = make_server(host, int(port), current_app._get_current_object(), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='live-api')
+    thread.daemon = True
+    thread.start()
+    logger.info("Serving the live api on http://{}/live".format(address))
+    return server
+
+
+# options of the commands running collectors, in the order of their help
+_COLLECTOR_OPTIONS = [
+    click.option("--debug", help='Do some command line printing', is_flag=True),
+    click.option("--concurrency", help='Number of past events to retrieve participants from at once', type=int, default=1),
+    click.option("--delta", help='Write live records only when participants or features change', is_flag=True),
+    click.option("--keyframe", help='In minutes, with --delta write every live record at least this often', type=int, default=15),
+    click.option("--flush-interval", help='Seconds records can be buffered before being written to the logs', type=float, default=1.0),
+    click.option("--fsync-interval", help='Seconds between fsync of the logs, 0 to leave it to the OS', type=float, default=0),
+    click.option("--output", help='Where records go, the log files, straight to --bulk-url or both',
+                 type=click.Choice(['file', 'bulk', 'both']), default='file'),
+    click.option("--bulk-url", help='Elasticsearch url, or Logstash http input url with --bulk-format ndjson'),
+    click.option("--bulk-format", help='Bulk request format', type=click.Choice(['elasticsearch', 'ndjson']), default='elasticsearch'),
+    click.option("--bulk-index", help='Elasticsearch index, strftime and {document_type} are expanded',
+                 default='zoom-{document_type}-%Y.%m.%d'),
+    click.option("--archive", help='Also write past events and participants to the parquet archive', is_flag=True),
+    click.option("--serve", help='host:port where to serve the live api of app.py from this process e.g. 127.0.0.1:8080'),
+    click.option("--trace", help='Write the timing spans of the stages of every iteration to zoom-trace.log', is_flag=True),
+    click.option("--profile", help='Every so many iterations, dump a cProfile and log the tracemalloc growth, 0 to never',
+                 type=int, default=0),
+]
+
+
+def _collector_options(command):
+    """Add the options shared by live_events and collector_daemon to a command"""
+    for option in reversed(_COLLECTOR_OPTIONS):
+        command = option(command)
+    return command
+
+
+def _collector_outputs(output, bulk_url, bulk_format, bulk_index, archive, flush_interval, fsync_interval):
+    """Check the output options of a collector command and build its outputs, see sink_factory"""
+    if output != 'file' and not bulk_url:
+        raise click.UsageError("--bulk-url is needed with --output {}".format(output))
+    if archive and not archive_available():
+        raise click.UsageError("pyarrow is needed for --archive")
+    return sink_factory(output, bulk_url=bulk_url, bulk_format=bulk_format, bulk_index=bulk_index,
+                        flush_interval=flush_interval, fsync_interval=fsync_interval, archive=archive)
+
+
+@click.command()
+@click.option("--meeting", help='We are dealing with meetings', is_flag=True)
+@click.option("--interval", help='In minutes to iterate', type=int, default=0)
+@click.option("--start_date", help='Start date for the report, it always considers just a day e.g. 2020-11-24')
+@click.option("--past", help='In case we are interested in past events', is_flag=True)
+@_collector_options
+@with_appcontext
+def live_events(meeting, interval, past, start_date, debug, concurrency, delta, keyframe, flush_interval, fsync_interval,
+                output, bulk_url, bulk_format, bulk_index, archive, serve, trace, profile):
+    """
+    Command to retrieve events and participants from Zoom 
+    """
+    logger.info("Starting script")
+    outputs = _collector_outputs(output, bulk_url, bulk_format, bulk_index, archive, flush_interval, fsync_interval)
+    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL, pool_size=max(10, concurrency))
+    server = _serve(serve) if serve else None
+    collector = EventCollector(zoomapi, meeting, past, start_date=start_date, debug=debug, concurrency=concurrency,
+                               delta=delta, keyframe=keyframe, interval=max(1, interval), outputs=outputs,
+                               store=livestore.store if server else None, trace=trace, profile=profile)
 
+    while True:
+        time.sleep(interval * 60)
+        if not collector.run_once(skip_empty=interval > 0):
+            time.sleep(60)
+            continue
         if interval == 0:
             break
-        
+
+    collector.close()
+    if server:
+        server.shutdown()
+
+
+@click.command()
+@click.option("--meetings-live", help='In minutes, interval of the live meetings collector, 0 to disable', type=int, default=1)
+@click.option("--webinars-live", help='In minutes, interval of the live webinars collector, 0 to disable', type=int, default=2)
+@click.option("--meetings-past", help='In minutes, interval of the past meetings collector, 0 to disable', type=int, default=10)
+@click.option("--webinars-past", help='In minutes, interval of the past webinars collector, 0 to disable', type=int, default=15)
+@_collector_options
+@with_appcontext
+def collector_daemon(debug, meetings_live, webinars_live, meetings_past, webinars_past, concurrency, delta, keyframe,
+                     flush_interval, fsync_interval, output, bulk_url, bulk_format, bulk_index, archive, serve, trace,
+                     profile):
+    """
+    Run all the live_events collectors in one process, sharing the Zoom client,
+    its connection pool and its rate limit budget
+    """
+    logger.info("Starting script")
+    outputs = _collector_outputs(output, bulk_url, bulk_format, bulk_index, archive, flush_interval, fsync_interval)
+    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL, pool_size=max(10, 2 * concurrency + 2))
+    server = _serve(serve) if serve else None
+    schedule = []
+    for meeting, past, interval in [(True, True, meetings_past), (True, False, meetings_live),
+                                    (False, False, webinars_live), (False, True, webinars_past)]:
+        if interval > 0:
+            collector = EventCollector(zoomapi, meeting, past, debug=debug, concurrency=concurrency,
+                                       delta=delta, keyframe=keyframe, interval=interval, outputs=outputs,
+                                       store=livestore.store if server else None, trace=trace, profile=profile)
+            schedule.append((collector, interval))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    def run(collector, interval, offset):
+        # spread the first iterations, as dispatch_collectors.sh used to do
+        stop.wait(offset)
+        try:
+            while not stop.is_set():
+                started = time.time()
+                try:
+                    ok = collector.run_once(skip_empty=True)
+                except Exception:
+                    # a collector thread must not die and leave the daemon running without it
+                    logger.error("{} iteration failed: {}".format(collector.name, traceback.format_exc()))
+                    ok = False
+                if not ok:
+                    stop.wait(60)
+                    continue
+                elapsed = time.time() - started
+                if debug:
+                    logger.debug("{} iteration took {:.1f}s".format(collector.name, elapsed))
+                if elapsed > interval * 60:
+                    logger.warn("{} iteration took {:.1f}s, longer than its interval".format(collector.name, elapsed))
+                stop.wait(max(0, interval * 60 - elapsed))
+        finally:
+            collector.close()
+
+    threads = []
+    for index, (collector, interval) in enumerate(schedule):
+        thread = threading.Thread(target=run, args=(collector, interval, index * 15), name=collector.name)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        while any(thread.is_alive() for thread in threads):
+            stop.wait(1)
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in threads:
+        thread.join()
+    if server:
+        server.shutdown()
+    logger.info("Collectors stopped")
+
 def _get_past_participants_simplified(zoom, meeting, uuid):
     """
 
@@ -241,36 +556,23 @@ def _get_past_participants_simplified(zoom, meeting, uuid):
         data['webinarId'] = uuid   
     return _get_past_participants(zoom, meeting, data)
 
+def _iter_past_participants(zoom, meeting, data):
+    """
+    Iterate over the pages of participants in a event
+    """
+    if meeting:
+        return iter_pages(zoom.list_participants_meeting, "participants", **data)
+    return iter_pages(zoom.list_participants_webinar, "participants", **data)
+
+
 def _get_past_participants(zoom, meeting, data):
     """
     Iteration to retrieve all participants in a event
     """
     events = []
     try: 
-        if meeting:
-            res = zoom.list_participants_meeting(**data)
-            events = res["participants"]
-            counter = 1
-            while res["next_page_token"] != '':
-                if counter > 9:
-                    counter = 1
-                    time.sleep(60)
-                data["next_page_token"] = res["next_page_token"]
-                res = zoom.list_participants_meeting(**data)
-                events.extend(res["participants"])
-                counter += 1
-        else:
-            res = zoom.list_participants_webinar(**data)
-            events = res["participants"]
-            counter = 1
-            while res["next_page_token"] != '':
-                if counter > 9:
-                    counter = 1
-                    time.sleep(60)
-                data["next_page_token"] = res["next_page_token"]
-                res = zoom.list_participants_webinar(**data)
-                events.extend(res["participants"])
-                counter += 1
+        for page in _iter_past_participants(zoom, meeting, data):
+            events.extend(page)
     except requests.exceptions.HTTPError as ex:
         if ex.errno == 404:
             logger.warn("{} {} is not over?".format('meeting' if meeting else 'webinar', data['meeting_id'] if meeting else data['webinarId']))
@@ -279,16 +581,57 @@ def _get_past_participants(zoom, meeting, data):
         time.sleep(60)       
     return events
 
+async def _aget_past_participants(zoom, meeting, uuid):
+    """
+    Retrieve all participants in a event with a AsyncZoomAPIClient
+    """
+    data = {
+        'type': 'past',
+        'page_size': 300
+    }
+    if meeting:
+        data['meeting_id'] = uuid
+        fetch = zoom.list_participants_meeting
+    else:
+        data['webinarId'] = uuid
+        fetch = zoom.list_participants_webinar
+    events = []
+    try:
+        async for page in aiter_pages(fetch, "participants", **data):
+            events.extend(page)
+    except requests.exceptions.RequestException as ex:
+        logger.warn("{} {}: {}".format('meeting' if meeting else 'webinar', uuid, ex))
+        events = None
+    return events
+
+def _get_past_participants_concurrently(zoom, loop, meeting, items):
+    """
+    Retrieve the participants of several events at once, at most zoom.concurrency at a time.
+
+    Returns:
+        list: participants of each item, in the same order, None for the ones that failed
+    """
+    if not items:
+        return []
+    async def gather():
+        return await asyncio.gather(*[_aget_past_participants(zoom, meeting, item['uuid']) for item in items])
+    return loop.run_until_complete(gather())
+
 @click.command()
 @click.option("--dry", help='Just output operations without doing it', is_flag=True)
 @click.option("--meeting", help='We are dealing with meetings', is_flag=True)
 @click.option("--interval", help='In minutes to iterate', type=int, default=0)
 @click.option("--eventuuid", help='Event id')
+@click.option("--output", help='File to write the participants to, stdout by default', type=click.File('w'), default='-')
+@click.option("--format", "output_format", help='One json per line, a json array or csv', type=click.Choice(STREAM_FORMATS), default='ndjson')
 @with_appcontext
-def past_participants(dry, meeting, interval, eventuuid):
+def past_participants(dry, meeting, interval, eventuuid, output, output_format):
     """
-    Get participants in a past meeting or webinar
+    Get participants in a past meeting or webinar, written as the pages arrive
     """
+    if interval and output_format != 'ndjson':
+        # every pass would add another array or csv header to the same output
+        raise click.UsageError("--interval only works with --format ndjson")
     logger.info("Starting script")
 
     data = {
@@ -302,84 +645,161 @@ def past_participants(dry, meeting, interval, eventuuid):
     else:
         data['webinarId'] =eventuuid
     
-    print(data)
-
-    if not interval:
-        ret = _get_past_participants(zoomapi, meeting, data=data)
-        print(json.dumps(ret))
-        return 
-    while interval > 0:
-        ret = _get_past_participants(zoomapi, meeting, data=data)
-        print(json.dumps(ret))
+    logger.info(data)
+
+    while True:
+        try:
+            count = write_pages(_iter_past_participants(zoomapi, meeting, dict(data)), output, output_format)
+            logger.info("{} participants of {} written".format(count, eventuuid))
+        except requests.exceptions.HTTPError as ex:
+            logger.warn(ex)
+        if not interval:
+            return
         time.sleep(interval*60)
 
 
+def _iter_registrant_rows(path):
+    """
+    Stream the registrants of a csv file with lines first_name,last_name,email
+    """
+    with open(path, 'r', newline='') as f:
+        for number, row in enumerate(csv.reader(f), 1):
+            if len(row) < 3 or '@' not in row[2]:
+                logger.warn("{}:{} is not first_name,last_name,email, skipped".format(path, number))
+                continue
+            yield {
+                'auto_approve': False,
+                'email': row[2].strip(),
+                'first_name': row[0],
+                'last_name': row[1]
+            }
+
+
+def _add_registrants(zoomapi, meeting_id, rows, checkpoint, logger2, concurrency=8, batch=500):
+    """
+    Register the rows to a meeting, concurrency of them at once within the rate limit budget,
+    batch rows read at a time. The registered emails go to the checkpoint, a failed row is
+    logged and left for the next run.
+
+    Returns:
+        tuple: number of rows registered, failed and skipped as already in the checkpoint
+    """
+    zoom = AsyncZoomAPIClient.from_client(zoomapi, concurrency=concurrency)
+    loop = asyncio.new_event_loop()
+    counts = {'registered': 0, 'failed': 0, 'skipped': 0}
+
+    async def register(data):
+        try:
+            res = await zoom.add_registrant_meeting(meeting_id, **data)
+        except requests.exceptions.RequestException as ex:
+            # e.g. a 4xx, a connection reset or a read timeout, left for the next run
+            logger.warn("Email: {} could not be registered: {}".format(data['email'], ex))
+            counts['failed'] += 1
+            return
+        checkpoint.add(data['email'])
+        counts['registered'] += 1
+        logger2.info("Email: {} Surname: {}".format(data['email'], data['last_name']))
+        logger2.info(res)
+
+    async def gather(pending):
+        # anything else failing one row must not stop the others, which get checkpointed
+        results = await asyncio.gather(*[register(data) for data in pending], return_exceptions=True)
+        for data, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error("Email: {} could not be registered: {!r}".format(data['email'], result))
+                counts['failed'] += 1
+
+    start = time.time()
+    pending = []
+    try:
+        for data in rows:
+            if data['email'] in checkpoint:
+                counts['skipped'] += 1
+                continue
+            pending.append(data)
+            if len(pending) == batch:
+                loop.run_until_complete(gather(pending))
+                pending = []
+                elapsed = time.time() - start
+                logger.info("{registered} registered, {failed} failed, {skipped} skipped".format(**counts) +
+                            " {:.1f} registrants/s".format(counts['registered'] / elapsed if elapsed else 0))
+        if pending:
+            loop.run_until_complete(gather(pending))
+    finally:
+        zoom.close()
+        loop.close()
+    elapsed = time.time() - start
+    logger.info("Meeting {}: {registered} registered, {failed} failed, {skipped} skipped in {elapsed:.1f}s {rate:.1f} registrants/s".format(
+        meeting_id, elapsed=elapsed, rate=counts['registered'] / elapsed if elapsed else 0, **counts))
+    return counts['registered'], counts['failed'], counts['skipped']
+
+
 @click.command()
 @click.option("--dry", help='Just output operations without doing it', is_flag=True)
-@click.option("--file", help='File to extract participants')
-@click.option("--meeting_id", help='meeting id to do operations on')
+@click.option("--file", help='File to extract participants', required=True)
+@click.option("--meeting_id", help='meeting id to do operations on', required=True)
+@click.option("--concurrency", help='Registrations in flight at once', type=int, default=8)
 @with_appcontext
-def add_registrant_onevent(dry, file, meeting_id):
+def add_registrant_onevent(dry, file, meeting_id, concurrency):
+    """
+    Register the people of a csv file, first_name,last_name,email per line, to a meeting.
+    The registered emails are kept in LOG_DIR/checkpoints, so a rerun after an interruption
+    or some failures only registers the rest.
+    """
     logger.info("Starting script")
-    lines = []
-    with open(file, 'r') as reader:
-        lines = reader.readlines()
-
     logger2 = helper.getFileLogger("sailing-club.log", "registrants")
-    zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
-   
-    for line in lines:
-        arr = line.split(',')
-        data = {
-            'auto_approve': False,
-            'email': arr[2].strip(),
-            'first_name': arr[0],
-            'last_name': arr[1] 
-        }
-        print(data)
-        if not dry:
-            res = zoomapi.add_registrant_meeting(meeting_id,**data)
-            print(res)
-            logger2.info("Email: {} Surname: {}".format(arr[2].strip(), arr[1]))
-            logger2.info(res)
-        else:
-            logger2.info("Email: {} Surname: {}".format(arr[2].strip(), arr[1]))
+    checkpoint = Checkpoint('registrants-{}'.format(meeting_id))
+    try:
+        if dry:
+            for data in _iter_registrant_rows(file):
+                if data['email'] not in checkpoint:
+                    print(data)
+                    logger2.info("Email: {} Surname: {}".format(data['email'], data['last_name']))
+            return
+        zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL, pool_size=concurrency)
+        registered, failed, skipped = _add_registrants(zoomapi, meeting_id, _iter_registrant_rows(file), checkpoint,
+                                                       logger2, concurrency=concurrency)
+        print(json.dumps({'registered': registered, 'failed': failed, 'skipped': skipped}))
+    finally:
+        checkpoint.close()
+
+def _iter_registrants(zoom, meeting, data):
+    """
+    Iterate over the pages of registrants in a event
+    """
+    if meeting:
+        return iter_pages(zoom.list_registrants_meeting, "registrants", **data)
+    return iter([])
+
 
 def _get_registrants(zoom, meeting, data):
     """
     Iteration to retrieve all registrants in a event
     """
     people = []
-    if meeting:
-        res = zoom.list_registrants_meeting(**data)
-        people = res["registrants"]
-        counter = 1
-        while res["next_page_token"] != '':
-            if counter > 9:
-                counter = 1
-                time.sleep(60)
-            data["next_page_token"] = res["next_page_token"]
-            res = zoom.list_registrants_meeting(**data)
-            people.extend(res["registrants"])
-            counter += 1
+    for page in _iter_registrants(zoom, meeting, data):
+        people.extend(page)
     return people
     
 
 @click.command()
 @click.option("--meeting_id", help='meeting id to do operations on')
+@click.option("--output", help='File to write the registrants to, stdout by default', type=click.File('w'), default='-')
+@click.option("--format", "output_format", help='One json per line, a json array or csv', type=click.Choice(STREAM_FORMATS), default='ndjson')
 @with_appcontext
-def list_registrants_onevent(meeting_id):
+def list_registrants_onevent(meeting_id, output, output_format):
+    """
+    List the registrants of a meeting, written as the pages arrive
+    """
     logger.info("Starting script")
     
-    logger2 = helper.getFileLogger("sailing-club-registrants.log", "listregistrants")
     zoomapi = ZoomAPIClient(ZOOM_API_CLIENT, ZOOM_API_SECRET, ZOOM_BASE_URL)
    
     data = {
         'meeting_id': meeting_id,
         'page_size': 300
     }
-    res = _get_registrants(zoomapi, meeting_id, data=data)
-    print(res)
-    logger2.info(json.dumps(res))
+    count = write_pages(_iter_registrants(zoomapi, meeting_id, data), output, output_format)
+    logger.info("{} registrants of {} written".format(count, meeting_id))
 
 
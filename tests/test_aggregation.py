@@ -0,0 +1,85 @@
+import unittest
+
+from utils import timeutil
+from utils.aggregation import LiveAggregator, Rollups, SizeHistogram
+
+NOW = timeutil.parse_epoch('2021-06-30T12:00:00Z')
+
+
+def _events(*sizes):
+    return [{'participants': size, 'has_pstn': False, 'has_voip': True, 'has_3rd_party_audio': False,
+             'has_video': size > 2, 'has_screen_share': False, 'has_recording': False, 'has_sip': False}
+            for size in sizes]
+
+
+class SizeHistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        sizes = SizeHistogram()
+        for size in [1] * 50 + [4] * 40 + [100] * 9 + [20000]:
+            sizes.add(size)
+        self.assertEqual(sizes.percentile(50), 1)
+        self.assertEqual(sizes.percentile(90), 4)
+        self.assertEqual(sizes.percentile(99), 100)
+        # the last bucket is unbounded, its lower bound is given
+        self.assertEqual(sizes.percentile(100), 10000)
+
+    def test_bucket_upper_bound(self):
+        sizes = SizeHistogram()
+        sizes.add(7)
+        self.assertEqual(sizes.percentile(50), 8)
+
+    def test_empty(self):
+        self.assertIsNone(SizeHistogram().percentile(50))
+
+
+class RollupsTest(unittest.TestCase):
+
+    def poll(self, rollups, now, *sizes):
+        return rollups.add(LiveAggregator(True).add(_events(*sizes)), now=now)
+
+    def test_summary(self):
+        summary = LiveAggregator(True).add(_events(1, 3, 10)).summary('2021-06-30T12:00:00Z')
+        self.assertEqual(summary['events'], 3)
+        self.assertEqual(summary['sumparticipants'], 14)
+        self.assertEqual(summary['sumvideo'], 2)
+        self.assertEqual(summary['sumvoip'], 3)
+
+    def test_minute_rollover(self):
+        rollups = Rollups(True, interval=1)
+        self.assertEqual(self.poll(rollups, NOW + 10, 2, 4), [])
+        self.assertEqual(self.poll(rollups, NOW + 40, 2, 8), [])
+        closed = self.poll(rollups, NOW + 70, 2)
+        self.assertEqual(len(closed), 1)
+        minute = closed[0]
+        self.assertEqual(minute['rollup'], 'minute')
+        self.assertEqual(minute['start_time'], '2021-06-30T12:00:00Z')
+        self.assertEqual(minute['polls'], 2)
+        self.assertEqual(minute['peak_events'], 2)
+        self.assertEqual(minute['peak_participants'], 10)
+        self.assertEqual(minute['avg_participants'], 8.0)
+        # 6 participants for the first interval, then 10 for 30 seconds
+        self.assertEqual(minute['participant_minutes'], 11)
+        self.assertEqual(minute['p50_size'], 2)
+        self.assertEqual(minute['p90_size'], 8)
+
+    def test_hour_rollover(self):
+        rollups = Rollups(True, interval=1)
+        self.poll(rollups, NOW + 10, 5)
+        closed = self.poll(rollups, NOW + 3610, 5)
+        self.assertEqual(sorted(record['rollup'] for record in closed), ['hour', 'minute'])
+        hour = next(record for record in closed if record['rollup'] == 'hour')
+        self.assertEqual(hour['start_time'], '2021-06-30T12:00:00Z')
+        self.assertEqual(hour['polls'], 1)
+
+    def test_flush_partial(self):
+        rollups = Rollups(False, interval=1)
+        self.poll(rollups, NOW + 10, 5)
+        records = rollups.flush()
+        self.assertEqual(sorted(record['rollup'] for record in records), ['day', 'hour', 'minute'])
+        self.assertTrue(all(record['partial'] == 1 and record['type'] == 'webinar' for record in records))
+        self.assertEqual(rollups.flush(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
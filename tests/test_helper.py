@@ -0,0 +1,40 @@
+import unittest
+
+from utils import timeutil
+from utils.helper import TimeBucketDedup
+
+NOW = timeutil.parse_epoch('2021-06-30T12:00:00Z')
+
+
+class TimeBucketDedupTest(unittest.TestCase):
+
+    def test_add_once(self):
+        dedup = TimeBucketDedup()
+        dedup.add('a', '2021-06-30T10:00:00Z')
+        dedup.add('a', '2021-06-29T10:00:00Z')
+        self.assertIn('a', dedup)
+        self.assertNotIn('b', dedup)
+        self.assertEqual(len(dedup), 1)
+
+    def test_expire_old_buckets(self):
+        dedup = TimeBucketDedup()
+        dedup.update({'old': '2021-06-27T10:00:00Z', 'edge': '2021-06-28T10:30:00Z',
+                      'recent': '2021-06-29T10:00:00Z'})
+        dedup.add('now', NOW)
+        # 2 days before NOW is 2021-06-28T12:00, the bucket of edge ends at 11:00
+        self.assertEqual(dedup.expire(2, now=NOW), 2)
+        self.assertEqual(sorted(dedup.ids), ['now', 'recent'])
+        self.assertEqual(dedup.expire(2, now=NOW), 0)
+
+    def test_bucket_kept_until_its_end(self):
+        dedup = TimeBucketDedup(bucket=3600)
+        dedup.add('a', '2021-06-28T11:30:00Z')
+        # the cutoff falls within the bucket, which is kept whole
+        self.assertEqual(dedup.expire(2, now=NOW - 1800), 0)
+        self.assertIn('a', dedup)
+        self.assertEqual(dedup.expire(2, now=NOW), 1)
+        self.assertEqual(len(dedup), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
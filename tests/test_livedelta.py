@@ -0,0 +1,64 @@
+import unittest
+
+from utils.livedelta import LiveDelta
+
+
+def _record(uuid, participants, **features):
+    record = {'type': 'meeting', 'uuid': uuid, 'zoomid': 900000000, 'topic': 'Topic {}'.format(uuid),
+              'participants': participants, 'start_time': '2021-06-30T12:00:00Z'}
+    for field in LiveDelta.FIELDS[1:]:
+        record[field] = features.get(field, 0)
+    return record
+
+
+class LiveDeltaTest(unittest.TestCase):
+
+    def test_written_on_change(self):
+        delta = LiveDelta(keyframe=900)
+        delta.start()
+        self.assertTrue(delta.changed(_record('a', 3), now=0))
+        self.assertFalse(delta.changed(_record('a', 3), now=60))
+        self.assertTrue(delta.changed(_record('a', 4), now=120))
+        self.assertTrue(delta.changed(_record('a', 4, has_video=1), now=180))
+
+    def test_keyframe(self):
+        delta = LiveDelta(keyframe=900)
+        delta.start()
+        self.assertTrue(delta.changed(_record('a', 3), now=0))
+        self.assertFalse(delta.changed(_record('a', 3), now=899))
+        self.assertTrue(delta.changed(_record('a', 3), now=900))
+        # the keyframe counts from the last record written
+        self.assertFalse(delta.changed(_record('a', 3), now=1000))
+
+    def test_ended_once(self):
+        delta = LiveDelta()
+        delta.start()
+        delta.changed(_record('a', 3), now=0)
+        delta.changed(_record('b', 5), now=0)
+        self.assertEqual(delta.ended('2021-06-30T12:00:00Z'), [])
+
+        delta.start()
+        delta.changed(_record('a', 3), now=60)
+        ended = delta.ended('2021-06-30T12:01:00Z')
+        self.assertEqual(ended, [{'type': 'meeting', 'participants': 0, 'uuid': 'b', 'zoomid': 900000000,
+                                  'topic': 'Topic b', 'ended': 1, 'start_time': '2021-06-30T12:01:00Z'}])
+        self.assertTrue(delta.known('a'))
+        self.assertFalse(delta.known('b'))
+        self.assertEqual(len(delta), 1)
+
+        delta.start()
+        delta.changed(_record('a', 3), now=120)
+        self.assertEqual(delta.ended('2021-06-30T12:02:00Z'), [])
+
+    def test_written_again_after_ended(self):
+        delta = LiveDelta()
+        delta.start()
+        delta.changed(_record('a', 3), now=0)
+        delta.start()
+        delta.ended('2021-06-30T12:01:00Z')
+        delta.start()
+        self.assertTrue(delta.changed(_record('a', 3), now=120))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import calendar
+import time
+import unittest
+
+from utils import timeutil
+
+
+def _strptime(date_string):
+    return calendar.timegm(time.strptime(date_string, timeutil.ISO_FORMAT))
+
+
+class ParseEpochTest(unittest.TestCase):
+
+    def test_fixed_layout_same_as_strptime(self):
+        for date_string in ['1970-01-01T00:00:00Z', '2020-11-24T10:00:00Z', '2020-02-29T23:59:59Z',
+                            '2021-12-31T00:00:01Z']:
+            self.assertEqual(timeutil.parse_epoch(date_string), _strptime(date_string))
+
+    def test_round_trip(self):
+        self.assertEqual(timeutil.iso(timeutil.parse_epoch('2021-06-30T12:00:00Z')), '2021-06-30T12:00:00Z')
+
+    def test_fallback_without_padding(self):
+        # not the fixed layout, strptime still takes it
+        self.assertEqual(timeutil.parse_epoch('2020-1-4T1:2:3Z'), _strptime('2020-01-04T01:02:03Z'))
+
+    def test_invalid_dates(self):
+        for date_string in ['2020-02-30T10:00:00Z', '2020-11-24T25:00:00Z', '2020-11-24 10:00:00', 'not a date']:
+            with self.assertRaises(ValueError):
+                timeutil.parse_epoch(date_string)
+
+
+class FrozenNowTest(unittest.TestCase):
+
+    def test_same_clock_within(self):
+        with timeutil.frozen_now() as frozen:
+            time.sleep(0.01)
+            self.assertEqual(timeutil.now(), frozen)
+        self.assertGreater(timeutil.now(), frozen)
+
+
+if __name__ == '__main__':
+    unittest.main()
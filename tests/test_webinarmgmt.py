@@ -0,0 +1,50 @@
+import unittest
+
+from utils import timeutil
+from services.webinarmgmt import _plan_global_action
+
+NOW = timeutil.parse_epoch('2021-06-30T12:00:00Z')
+
+
+def _members(*upns):
+    return [{'upn': upn, 'primaryAccountEmail': '{}@cern.ch'.format(upn), 'id': 'id-{}'.format(upn)} for upn in upns]
+
+
+class PlanGlobalActionTest(unittest.TestCase):
+
+    def plan(self, members1000, members500, keep1000, lastwebinar, days=30):
+        return _plan_global_action(_members(*members1000), _members(*members500), set(keep1000), lastwebinar,
+                                   days, True, NOW)
+
+    def test_downgrade_without_upcoming_webinar(self):
+        plan = self.plan(['alice', 'bob', 'carol'], ['carol'], ['alice'], {})
+        self.assertEqual(plan['remove1000'], ['bob', 'carol'])
+        self.assertEqual(plan['add500'], ['bob'])
+        self.assertEqual(plan['set500'], ['carol'])
+        self.assertEqual(plan['remove500'], [])
+
+    def test_inactive_500_owner_removed(self):
+        plan = self.plan([], ['dave', 'erin'], [], {'dave@cern.ch': '2021-01-01T10:00:00Z',
+                                                     'erin@cern.ch': '2021-06-20T10:00:00Z'})
+        self.assertEqual(plan['remove500'], ['dave'])
+
+    def test_never_used_keeps_500(self):
+        plan = self.plan([], ['frank'], [], {})
+        self.assertEqual(plan['remove500'], [])
+
+    def test_kept_1000_owner_not_removed_from_500(self):
+        # an upcoming 1000 attendees webinar, but the last past one is old
+        plan = self.plan(['alice'], ['alice', 'dave'], ['alice'], {'alice@cern.ch': '2021-01-01T10:00:00Z',
+                                                                   'dave@cern.ch': '2021-01-01T10:00:00Z'})
+        self.assertEqual(plan['remove1000'], [])
+        self.assertEqual(plan['remove500'], ['dave'])
+
+    def test_inactive_downgraded_owner_not_set_to_500(self):
+        plan = self.plan(['bob'], ['bob'], [], {'bob@cern.ch': '2021-01-01T10:00:00Z'})
+        self.assertEqual(plan['remove1000'], ['bob'])
+        self.assertEqual(plan['set500'], [])
+        self.assertEqual(plan['remove500'], ['bob'])
+
+
+if __name__ == '__main__':
+    unittest.main()
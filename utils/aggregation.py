@@ -0,0 +1,192 @@
+import bisect
+
+from utils import timeutil
+
+# upper bounds of the meeting size histogram buckets
+SIZE_BUCKETS = [1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30, 40, 50, 75, 100, 150, 200, 300,
+                500, 750, 1000, 1500, 2000, 3000, 5000, 10000, float('inf')]
+
+# rollup name: length in seconds
+WINDOWS = (
+    ('minute', 60),
+    ('hour', 3600),
+    ('day', 86400),
+)
+
+
+class SizeHistogram:
+    """Histogram of meeting sizes with fixed buckets, to get percentiles without keeping the sizes"""
+
+    def __init__(self):
+        self.counts = [0] * len(SIZE_BUCKETS)
+        self.total = 0
+
+    def add(self, size):
+        self.counts[bisect.bisect_left(SIZE_BUCKETS, size)] += 1
+        self.total += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q (0-100) percentile, None if empty"""
+        if not self.total:
+            return None
+        rank = q / 100.0 * self.total
+        cumulative = 0
+        for bound, count in zip(SIZE_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return bound if bound != float('inf') else SIZE_BUCKETS[-2]
+        return SIZE_BUCKETS[-2]
+
+
+class LiveAggregator:
+    """All the counters of the live summary, computed in one pass as pages arrive.
+
+    Args:
+        meeting (bool): meetings if True, otherwise webinars
+    """
+
+    def __init__(self, meeting):
+        self.type = 'meeting' if meeting else 'webinar'
+        self.events = 0
+        self.participants = 0
+        self.pstn = 0
+        self.voip = 0
+        self.thirdpartyaudio = 0
+        self.video = 0
+        self.screenshare = 0
+        self.recording = 0
+        self.sip = 0
+        self.inroom = 0
+        self.sizes = SizeHistogram()
+
+    def add(self, page):
+        """Add a page of live events"""
+        for item in page:
+            self.events += 1
+            self.participants += item["participants"]
+            self.sizes.add(item["participants"])
+            if item['has_pstn']:
+                self.pstn += 1
+            if item['has_voip']:
+                self.voip += 1
+            if item['has_3rd_party_audio']:
+                self.thirdpartyaudio += 1
+            if item['has_video']:
+                self.video += 1
+            if item['has_screen_share']:
+                self.screenshare += 1
+            if item['has_recording']:
+                self.recording += 1
+            if item['has_sip']:
+                self.sip += 1
+            self.inroom += item.get("in_room_participants", 0)
+        return self
+
+    def summary(self, start_time):
+        """The live summary record
+
+        Args:
+            start_time (str): UTC date of the poll
+        """
+        return {
+            "type": self.type,
+            "events": self.events,
+            "sumparticipants": self.participants,
+            "sumpstn": self.pstn,
+            "sumvoip": self.voip,
+            "sum3partyaudio": self.thirdpartyaudio,
+            "sumscreenshare": self.screenshare,
+            "sumrecording": self.recording,
+            "sumsip": self.sip,
+            "sumvideo": self.video,
+            "suminroom": self.inroom,
+            "start_time": start_time
+        }
+
+
+class _Window:
+    def __init__(self, start):
+        self.start = start
+        self.polls = 0
+        self.peak_events = 0
+        self.peak_participants = 0
+        self.sum_participants = 0
+        self.participant_minutes = 0.0
+        self.sizes = SizeHistogram()
+
+
+class Rollups:
+    """Per minute, hour and day rollups of the live summaries, updated incrementally at every poll.
+
+    A compact record is produced for every window that gets closed by a poll falling in the next one.
+
+    Args:
+        meeting (bool): meetings if True, otherwise webinars
+        interval (int): minutes between polls, used for the participant-minutes of the first poll
+            and as a cap after a gap in the polls
+    """
+
+    def __init__(self, meeting, interval=1):
+        self.type = 'meeting' if meeting else 'webinar'
+        self.interval = interval * 60
+        self.windows = {}
+        self.last_poll = None
+
+    def add(self, aggregator, now=None):
+        """Account a poll
+
+        Args:
+            aggregator (LiveAggregator): the counters of the poll
+            now (float): epoch of the poll
+
+        Returns:
+            list: rollup records of the windows closed by this poll
+        """
+        now = now if now is not None else timeutil.now()
+        elapsed = self.interval if self.last_poll is None else min(now - self.last_poll, 3 * self.interval)
+        self.last_poll = now
+        closed = []
+        for name, length in WINDOWS:
+            start = int(now - now % length)
+            window = self.windows.get(name)
+            if window and window.start != start:
+                closed.append(self._record(name, window))
+                window = None
+            if not window:
+                window = self.windows[name] = _Window(start)
+            window.polls += 1
+            window.peak_events = max(window.peak_events, aggregator.events)
+            window.peak_participants = max(window.peak_participants, aggregator.participants)
+            window.sum_participants += aggregator.participants
+            window.participant_minutes += aggregator.participants * elapsed / 60.0
+            window.sizes.merge(aggregator.sizes)
+        return closed
+
+    def flush(self):
+        """Records of the windows still open, e.g. when stopping"""
+        records = [self._record(name, window, partial=True) for name, window in self.windows.items()]
+        self.windows = {}
+        return records
+
+    def _record(self, name, window, partial=False):
+        record = {
+            "type": self.type,
+            "rollup": name,
+            "start_time": timeutil.iso(window.start),
+            "polls": window.polls,
+            "peak_events": window.peak_events,
+            "peak_participants": window.peak_participants,
+            "avg_participants": round(window.sum_participants / float(window.polls), 1),
+            "participant_minutes": int(round(window.participant_minutes)),
+            "p50_size": window.sizes.percentile(50),
+            "p90_size": window.sizes.percentile(90),
+            "p99_size": window.sizes.percentile(99)
+        }
+        if partial:
+            record["partial"] = 1
+        return record
@@ -0,0 +1,289 @@
+import glob
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from utils.helper import dumps
+from utils import timeutil
+from config import LOG_DIR
+
+logger = logging.getLogger('zoom-dashboard')
+
+ARCHIVE_DIR = os.path.join(LOG_DIR, 'archive')
+
+# log file of the past collectors: (dataset, type)
+ARCHIVED = {
+    'zoom-meetings-past.log': ('events', 'meeting'),
+    'zoom-webinars-past.log': ('events', 'webinar'),
+    'zoom-meetings-pasticipants.log': ('participants', 'meeting'),
+    'zoom-webinars-pasticipants.log': ('participants', 'webinar'),
+}
+
+# (column, arrow type name, dictionary encoded), the fields without a column go to the extra json column
+COLUMNS = {
+    'events': [
+        ('uuid', 'string', False),
+        ('zoomid', 'int64', False),
+        ('topic', 'string', False),
+        ('host', 'string', True),
+        ('email', 'string', True),
+        ('user_type', 'string', True),
+        ('dept', 'string', True),
+        ('start_time', 'timestamp', False),
+        ('end_time', 'timestamp', False),
+        ('duration', 'int64', False),
+        ('participants', 'int64', False),
+        ('has_pstn', 'bool', False),
+        ('has_voip', 'bool', False),
+        ('has_3rd_party_audio', 'bool', False),
+        ('has_video', 'bool', False),
+        ('has_screen_share', 'bool', False),
+        ('has_recording', 'bool', False),
+        ('has_sip', 'bool', False),
+    ],
+    'participants': [
+        ('uuid', 'string', True),
+        ('zoomid', 'int64', False),
+        ('participantid', 'string', False),
+        ('user_id', 'string', False),
+        ('user_name', 'string', False),
+        ('email', 'string', True),
+        ('device', 'string', True),
+        ('ip_address', 'string', False),
+        ('location', 'string', True),
+        ('network_type', 'string', True),
+        ('data_center', 'string', True),
+        ('connection_type', 'string', True),
+        ('join_time', 'timestamp', False),
+        ('leave_time', 'timestamp', False),
+        ('duration', 'float64', False),
+        ('version', 'string', True),
+        ('leave_reason', 'string', True),
+        ('role', 'string', True),
+    ],
+}
+
+# the flags set by the collectors are implied by the type partition
+DROPPED = ('meeting', 'webinar')
+
+# columns identifying a record, duplicates are dropped when the parts of a partition are merged
+KEYS = {
+    'events': ('uuid',),
+    'participants': ('uuid', 'participantid', 'join_time'),
+}
+
+
+def available():
+    return pa is not None
+
+
+def _arrow_type(name):
+    return {
+        'string': pa.string,
+        'int64': pa.int64,
+        'float64': pa.float64,
+        'bool': pa.bool_,
+        'timestamp': lambda: pa.timestamp('s', tz='UTC'),
+    }[name]()
+
+
+def schema(dataset):
+    """Arrow schema of a dataset, events or participants"""
+    fields = [pa.field(name, _arrow_type(kind)) for name, kind, _ in COLUMNS[dataset]]
+    fields.append(pa.field('extra', pa.string()))
+    return pa.schema(fields)
+
+
+def _value(kind, value):
+    if value is None or value == '':
+        return None
+    if kind == 'timestamp':
+        try:
+            return timeutil.parse_epoch(value)
+        except (TypeError, ValueError):
+            return None
+    if kind == 'bool':
+        return bool(value)
+    try:
+        if kind == 'int64':
+            return int(value)
+        if kind == 'float64':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _day(dataset, record):
+    value = record.get('start_time' if dataset == 'events' else 'join_time') or record.get('start_time')
+    if value:
+        return value[:10]
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+
+def to_table(dataset, records):
+    """Arrow table of a list of records, the fields without a column are kept as json in extra"""
+    columns = COLUMNS[dataset]
+    known = set(name for name, _, _ in columns)
+    arrays = []
+    for name, kind, _ in columns:
+        arrays.append(pa.array([_value(kind, record.get(name)) for record in records], type=_arrow_type(kind)))
+    extra = []
+    for record in records:
+        rest = {k: v for k, v in record.items() if k not in known and k not in DROPPED}
+        extra.append(dumps(rest) if rest else None)
+    arrays.append(pa.array(extra, type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=schema(dataset))
+
+
+def partition_dir(dataset, typeofevent, day, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, dataset, 'type={}'.format(typeofevent), 'date={}'.format(day))
+
+
+def _write(table, dataset, path):
+    """Write a parquet file atomically, readers skip the names starting with a dot"""
+    tmp = os.path.join(os.path.dirname(path), '.{}'.format(os.path.basename(path)))
+    pq.write_table(table, tmp, compression='zstd',
+                   use_dictionary=[name for name, _, dictionary in COLUMNS[dataset] if dictionary])
+    os.rename(tmp, path)
+
+
+def _unique(table, dataset):
+    """Table without the records already seen in it, see KEYS, the first one is kept"""
+    keys = zip(*[table.column(name).to_pylist() for name in KEYS[dataset]])
+    seen = set()
+    indices = []
+    for i, key in enumerate(keys):
+        if key[0] is None:
+            indices.append(i)
+        elif key not in seen:
+            seen.add(key)
+            indices.append(i)
+    if len(indices) == table.num_rows:
+        return table
+    return table.take(pa.array(indices, type=pa.int64()))
+
+
+def compact(dataset, typeofevent, day, archive_dir=ARCHIVE_DIR):
+    """Merge the parts of a daily partition into one file, without the duplicated records,
+    e.g. from a log file imported again after a crash of the collector
+
+    Returns:
+        int: number of parts merged, 0 if there was nothing to do
+    """
+    directory = partition_dir(dataset, typeofevent, day, archive_dir)
+    parts = sorted(glob.glob(os.path.join(directory, 'part-*.parquet')))
+    if len(parts) < 2:
+        return 0
+    table = _unique(pa.concat_tables([pq.read_table(part) for part in parts]), dataset)
+    _write(table, dataset, os.path.join(directory, 'part-{}.parquet'.format(day)))
+    for part in parts:
+        if os.path.basename(part) != 'part-{}.parquet'.format(day):
+            os.remove(part)
+    return len(parts)
+
+
+class ArchiveSink:
+    """Output writing the records of a past collector to daily partitioned parquet files,
+    compressed with zstd and with dictionary encoded strings:
+
+        <archive_dir>/<events|participants>/type=<meeting|webinar>/date=<YYYY-MM-DD>/part-*.parquet
+
+    The collectors flush after every page, so records are kept in memory across flushes,
+    and written in one part per day once batch_rows of them are buffered, the oldest
+    one is max_age seconds old, or on close. The log files still have what a crash loses,
+    see archive-import. After writing, the days older than compact_after days get their
+    parts merged in one file, again if late records added a part to them, and records
+    archived twice are dropped then.
+
+    Args:
+        log_file_name (str): Log file of the collector, see ARCHIVED
+        archive_dir (str): Root of the archive
+        compact_after (int): Days after which a partition no longer gets records
+        batch_rows (int): Records buffered before writing them
+        max_age (float): Seconds a record can be buffered before writing it
+    """
+
+    def __init__(self, log_file_name, archive_dir=ARCHIVE_DIR, compact_after=2, batch_rows=10000, max_age=600):
+        if pa is None:
+            raise RuntimeError("pyarrow is needed to archive the records")
+        self.dataset, self.type = ARCHIVED[log_file_name]
+        self.archive_dir = archive_dir
+        self.compact_after = compact_after
+        self.batch_rows = batch_rows
+        self.max_age = max_age
+        self.records = []
+        self.first = None
+        self.compacted = set()
+
+    def write(self, record):
+        if not self.records:
+            self.first = time.time()
+        self.records.append(record)
+
+    def flush(self):
+        if self.records and (len(self.records) >= self.batch_rows or time.time() - self.first >= self.max_age):
+            self._write_parts()
+
+    def _write_parts(self):
+        days = {}
+        for record in self.records:
+            days.setdefault(_day(self.dataset, record), []).append(record)
+        # the records are kept until every part is written, if one fails they are written
+        # again with the next flush, and the parts already written are deduplicated by compact
+        tables = {day: to_table(self.dataset, records) for day, records in days.items()}
+        for day, table in sorted(tables.items()):
+            directory = partition_dir(self.dataset, self.type, day, self.archive_dir)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, 'part-{:.6f}.parquet'.format(time.time()))
+            _write(table, self.dataset, path)
+            # late records, the day needs compacting again
+            self.compacted.discard(day)
+        self.records = []
+        self._compact()
+
+    def _compact(self):
+        limit = (datetime.utcnow() - timedelta(days=self.compact_after)).strftime('%Y-%m-%d')
+        for day in days_in(self.dataset, self.type, archive_dir=self.archive_dir):
+            if day < limit and day not in self.compacted:
+                merged = compact(self.dataset, self.type, day, self.archive_dir)
+                if merged:
+                    logger.info("Archive {} {} {}: {} parts merged".format(self.dataset, self.type, day, merged))
+                self.compacted.add(day)
+
+    def close(self):
+        if self.records:
+            self._write_parts()
+
+
+def days_in(dataset, typeofevent, start_date=None, end_date=None, archive_dir=ARCHIVE_DIR):
+    """Days of the partitions of a dataset, between start_date and end_date (YYYY-MM-DD) included"""
+    days = []
+    for directory in glob.glob(os.path.join(archive_dir, dataset, 'type={}'.format(typeofevent), 'date=*')):
+        day = directory.rsplit('=', 1)[1]
+        if (not start_date or day >= start_date) and (not end_date or day <= end_date):
+            days.append(day)
+    return sorted(days)
+
+
+def read(dataset, typeofevent, columns, start_date=None, end_date=None, archive_dir=ARCHIVE_DIR):
+    """Read some columns of a dataset between two days
+
+    Returns:
+        list: (day, pyarrow.Table) for every daily partition
+    """
+    tables = []
+    for day in days_in(dataset, typeofevent, start_date, end_date, archive_dir):
+        parts = sorted(glob.glob(os.path.join(partition_dir(dataset, typeofevent, day, archive_dir), 'part-*.parquet')))
+        if parts:
+            tables.append((day, pa.concat_tables([pq.read_table(part, columns=columns) for part in parts])))
+    return tables
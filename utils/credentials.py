@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from utils import timeutil
+from utils.filelock import FileLock
+from config import LOG_DIR
+
+logger = logging.getLogger('zoom-dashboard')
+
+CREDENTIALS_DIR = os.path.join(LOG_DIR, 'credentials')
+IDENTITIES_DB = os.path.join(LOG_DIR, 'index', 'identities.db')
+
+
+class TokenCache:
+    """Access token shared by the threads of this process and, through a locked file,
+    by every process using the same name, refreshed before it expires.
+
+    Args:
+        name (str): Name of the token, e.g. keycloak-authz, used for the file
+        fetch (function): Gets a new token, returning (token, seconds it is valid)
+        margin (int): Seconds before expiry when the token is refreshed
+        directory (str): Where the token files are kept
+    """
+
+    def __init__(self, name, fetch, margin=60, directory=CREDENTIALS_DIR):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+        self.path = os.path.join(directory, '{}.json'.format(name))
+        self.lock = FileLock('{}.lock'.format(self.path))
+        self.fetch = fetch
+        self.margin = margin
+        self.token = None
+        self.expires = 0
+
+    def get(self):
+        """A token valid for at least margin seconds"""
+        if self.token and timeutil.now() < self.expires - self.margin:
+            return self.token
+        with self.lock:
+            cached = self._read()
+            if cached and timeutil.now() < cached['expires'] - self.margin:
+                self.token, self.expires = cached['token'], cached['expires']
+                return self.token
+            token, expires_in = self.fetch()
+            self.token, self.expires = token, timeutil.now() + expires_in
+            self._write({'token': self.token, 'expires': self.expires})
+            logger.debug("{} refreshed, valid for {}s".format(os.path.basename(self.path), expires_in))
+            return self.token
+
+    def invalidate(self, token):
+        """Forget a token that was refused, unless another thread or process already replaced it"""
+        with self.lock:
+            if self.token == token:
+                self.token, self.expires = None, 0
+            cached = self._read()
+            if cached and cached['token'] == token:
+                os.remove(self.path)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, cached):
+        tmp = '{}.tmp'.format(self.path)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cached, f)
+        os.rename(tmp, self.path)
+
+
+class IdentityCache:
+    """Persistent upn: identity id map of the authorization service, whose entries expire after ttl seconds
+
+    Args:
+        path (str): sqlite database
+        ttl (int): Seconds an identity is trusted for
+    """
+
+    def __init__(self, path=IDENTITIES_DB, ttl=7 * 86400):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS identities (upn TEXT PRIMARY KEY, id TEXT, updated INTEGER)')
+        self.conn.commit()
+
+    def get(self, upn):
+        """Identity id of a upn, None if unknown or expired"""
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM identities WHERE upn = ? AND updated >= ?',
+                                    (upn, int(timeutil.now()) - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def update(self, identities):
+        """Store a dict upn: identity id"""
+        if not identities:
+            return
+        updated = int(timeutil.now())
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO identities (upn, id, updated) VALUES (?, ?, ?)',
+                                  [(upn, identity, updated) for upn, identity in identities.items()])
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
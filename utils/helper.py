@@ -4,11 +4,23 @@ import json
 import os 
 import glob
 import time
-from datetime import datetime
+import sqlite3
+import heapq
+import queue
+import threading
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+from utils import timeutil
+from utils.metrics import RECORDS_WRITTEN, BYTES_WRITTEN
 from config import LOG_DIR
 
+logger = logging.getLogger('zoom-dashboard')
+
 class helper:
     
     @staticmethod
@@ -90,8 +102,332 @@ class helper:
         Args:
             date_string (string): string in  UTC which difference in time we want to know
         """
-        d1 = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%SZ')
-        d0 = datetime.utcnow()
+        return (timeutil.now() - timeutil.parse_epoch(date_string)) / 60
+
+
+def dumps(record):
+    """Serialize a record to json, with orjson if it is installed"""
+    if orjson:
+        try:
+            return orjson.dumps(record).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(record)
+
+
+# marker put in the queue of a RecordWriter to write what is pending right away
+_FLUSH = object()
+
+
+class RecordWriter:
+    """Buffered writer of json records, one per line, to a log file under LOG_DIR.
+
+    Records go through a bounded queue to a background thread that serializes them and
+    writes them in batches, so the collectors don't do a small synchronous write per
+    record on the shared filesystem. Files are rotated at midnight keeping 60 days, with
+    the same names as helper.getFileLogger, so filebeat doesn't see any difference.
+    Records must not be modified once written.
+
+    Args:
+        log_file_name (str): Name of the file
+        flush_interval (float): Seconds a record can wait in the queue for a batch to fill up
+        fsync_interval (float): Seconds between fsync of the file, 0 to leave it to the OS
+        batch_size (int): Maximum number of records written at once
+        maxsize (int): Size of the queue, write blocks when it is full
+    """
+
+    def __init__(self, log_file_name, flush_interval=1.0, fsync_interval=0, batch_size=1000, maxsize=10000):
+        self.log_file_name = log_file_name
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.handler = logging.handlers.TimedRotatingFileHandler(os.path.join(LOG_DIR, log_file_name), when='midnight', backupCount=60)
+        self.queue = queue.Queue(maxsize)
+        self.last_fsync = time.time()
+        # last failed write, raised by the next flush so the caller knows the records are not in the file
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='writer-{}'.format(log_file_name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, record):
+        """Queue a record (dict) to be written"""
+        self.queue.put(record)
+
+    def flush(self):
+        """Block until all the records written so far are in the file
+
+        Raises:
+            Exception: the error of a write that failed since the previous flush
+        """
+        self.queue.put(_FLUSH)
+        self.queue.join()
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.handler.close()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+            while batch[-1] is not None and batch[-1] is not _FLUSH and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            records = [record for record in batch if record is not None and record is not _FLUSH]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                logger.exception("Could not write {} records to {}".format(len(records), self.log_file_name))
+                self.error = e
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if closing:
+                return
+
+    def _write(self, records):
+        handler = self.handler
+        if handler.shouldRollover(None):
+            handler.doRollover()
+        data = ''.join(dumps(record) + '\n' for record in records)
+        handler.stream.write(data)
+        handler.stream.flush()
+        RECORDS_WRITTEN.inc(len(records), log=self.log_file_name)
+        BYTES_WRITTEN.inc(len(data.encode('utf-8')), log=self.log_file_name)
+        if self.fsync_interval and time.time() - self.last_fsync >= self.fsync_interval:
+            os.fsync(handler.stream.fileno())
+            self.last_fsync = time.time()
+
+
+class TimeBucketDedup:
+    """Set of uuids, to avoid duplicates, that forgets the old ones.
+
+    Start times are kept as epoch integers and the uuids grouped in buckets of
+    bucket seconds, so expire drops whole buckets and its cost only depends on the
+    number of elements being removed, not on the ones kept.
+
+    Args:
+        bucket (int): Size of the buckets in seconds e.g. an hour
+    """
+
+    def __init__(self, bucket=3600):
+        self.bucket = bucket
+        self.ids = {}
+        self.buckets = {}
+        self.heap = []
+
+    def __contains__(self, uuid):
+        return uuid in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, uuid, start_time):
+        """Add an element
+
+        Args:
+            uuid (str): id of the element
+            start_time (str or int): UTC date string as returned by Zoom or epoch
+        """
+        if uuid in self.ids:
+            return
+        if not isinstance(start_time, int):
+            start_time = timeutil.parse_epoch(start_time)
+        self.ids[uuid] = start_time
+        key = start_time - start_time % self.bucket
+        if key not in self.buckets:
+            self.buckets[key] = set()
+            heapq.heappush(self.heap, key)
+        self.buckets[key].add(uuid)
+
+    def update(self, hashids):
+        """Add all elements of a dict uuid:start_time e.g. from helper.readFileArray"""
+        for uuid, start_time in hashids.items():
+            self.add(uuid, start_time)
+
+    def expire(self, delta=2, now=None):
+        """Remove the buckets older than UTC now - delta days
+
+        Returns:
+            int: number of elements removed
+        """
+        cutoff = (now if now is not None else timeutil.now()) - delta * 86400
+        removed = 0
+        while self.heap and self.heap[0] + self.bucket <= cutoff:
+            for uuid in self.buckets.pop(heapq.heappop(self.heap)):
+                del self.ids[uuid]
+                removed += 1
+        return removed
+
+
+class DedupIndex:
+    """Persistent uuid:start_time index of the elements written to a log file.
+
+    It lives in sqlite under LOG_DIR/index and it is updated by the collector as it
+    writes, so a restart loads the last days with a query instead of re-parsing every
+    rotated log file with helper.readFileArray.
+
+    Args:
+        log_file_name (str): Name of the log file the index belongs to
+        keep (int): Number of days to keep in the index, as the rotated logs
+    """
+
+    def __init__(self, log_file_name, keep=60):
+        self.log_file_name = log_file_name
+        self.keep = keep
+        index_dir = os.path.join(LOG_DIR, 'index')
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        self.path = os.path.join(index_dir, '{}.db'.format(log_file_name))
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS ids (uuid TEXT PRIMARY KEY, start_time TEXT, start_epoch INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ids_start_epoch ON ids (start_epoch)')
+        self.conn.commit()
+        self.pending = []
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM ids').fetchone()[0]
+
+    def load(self, delta=2):
+        """Get the elements of the last delta days. The first time, the index is built
+        from the existing log files.
+
+        Args:
+            delta (int): Number of days to load
+
+        Returns:
+            dict: A dict of uuid:start_time
+        """
+        if len(self) == 0:
+            hashids = helper.readFileArray(self.log_file_name, delta=delta)
+            logger.info("Building index {} from the logs: {} elements".format(self.path, len(hashids)))
+            for uuid, start_time in hashids.items():
+                self.add(uuid, start_time)
+            self.commit()
+        since = int(timeutil.now()) - delta * 86400
+        return dict(self.conn.execute('SELECT uuid, start_time FROM ids WHERE start_epoch >= ?', (since,)))
+
+    def add(self, uuid, start_time):
+        """Record an element, it is stored on the next commit"""
+        self.pending.append((uuid, start_time, timeutil.parse_epoch(start_time)))
+
+    def commit(self):
+        """Store the elements added since the last commit and forget the ones older than keep days"""
+        if self.pending:
+            self.conn.executemany('INSERT OR IGNORE INTO ids (uuid, start_time, start_epoch) VALUES (?, ?, ?)', self.pending)
+            self.pending = []
+        self.conn.execute('DELETE FROM ids WHERE start_epoch < ?', (int(timeutil.now()) - self.keep * 86400,))
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class LastWebinarIndex:
+    """Persistent host email:end_time index of the last webinar of every host.
+
+    It lives in sqlite under LOG_DIR/index and it is updated by the past webinars
+    collector as it writes, so the license checks look it up instead of paging
+    through months of past webinars.
+
+    Args:
+        path (str): sqlite database, by default LOG_DIR/index/last-webinar.db
+    """
+
+    def __init__(self, path=None):
+        index_dir = os.path.join(LOG_DIR, 'index')
+        if not path and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        self.path = path or os.path.join(index_dir, 'last-webinar.db')
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS hosts (email TEXT PRIMARY KEY, end_time TEXT, end_epoch INTEGER)')
+        self.conn.commit()
+        self.pending = {}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM hosts').fetchone()[0]
+
+    def add(self, email, end_time):
+        """Record a webinar of a host, it is stored on the next commit if it is its last one"""
+        end_epoch = timeutil.parse_epoch(end_time)
+        if email not in self.pending or self.pending[email][1] < end_epoch:
+            self.pending[email] = (end_time, end_epoch)
+
+    def update(self, lastwebinar):
+        """Add all the elements of a dict email:end_time e.g. from _last_zoom_webinar"""
+        for email, end_time in lastwebinar.items():
+            self.add(email, end_time)
+
+    def commit(self):
+        if self.pending:
+            rows = [(email, end_time, end_epoch) for email, (end_time, end_epoch) in self.pending.items()]
+            self.conn.executemany('INSERT OR IGNORE INTO hosts (email, end_time, end_epoch) VALUES (?, ?, ?)', rows)
+            self.conn.executemany('UPDATE hosts SET end_time = ?, end_epoch = ? WHERE email = ? AND end_epoch < ?',
+                                  [(end_time, end_epoch, email, end_epoch) for email, end_time, end_epoch in rows])
+            self.conn.commit()
+            self.pending = {}
+
+    def load(self, days=None):
+        """Get the hosts with a webinar in the last days, all of them if None
+
+        Returns:
+            dict: A dict of email:end_time
+        """
+        if days is None:
+            return dict(self.conn.execute('SELECT email, end_time FROM hosts'))
+        since = int(timeutil.now()) - days * 86400
+        return dict(self.conn.execute('SELECT email, end_time FROM hosts WHERE end_epoch >= ?', (since,)))
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class Checkpoint:
+    """Append only file of the keys of the items already done by a resumable job,
+    e.g. the emails registered to a meeting, so a rerun skips them.
+
+    Every key is flushed as soon as it is added, an interrupted job loses at most
+    the items in flight.
+
+    Args:
+        name (str): Name of the job, the file is LOG_DIR/checkpoints/<name>.done
+    """
+
+    def __init__(self, name):
+        checkpoint_dir = os.path.join(LOG_DIR, 'checkpoints')
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        self.path = os.path.join(checkpoint_dir, '{}.done'.format(name))
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.done.update(line.rstrip('\n') for line in f if line.strip())
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a')
+
+    def __len__(self):
+        return len(self.done)
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        with self.lock:
+            if key not in self.done:
+                self.done.add(key)
+                self.file.write('{}\n'.format(key))
+                self.file.flush()
 
-        diff = d0 - d1
-        return diff.total_seconds()/60      
+    def close(self):
+        self.file.close()
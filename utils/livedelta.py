@@ -0,0 +1,77 @@
+from utils import timeutil
+
+
+class LiveDelta:
+    """Change-only emission of the per meeting live records.
+
+    It keeps the last state written of every uuid, so a record is only written when the
+    participants or the features of a meeting change, when the last one is older than
+    keyframe seconds, or once with ended=1 when the meeting is no longer live.
+
+    Args:
+        keyframe (int): seconds after which a record is written even if nothing changed
+    """
+
+    # fields of the live record whose change triggers a new record
+    FIELDS = ('participants', 'has_pstn', 'has_voip', 'has_3partyaudio', 'has_screenshare',
+              'has_recording', 'has_sip', 'has_video')
+
+    def __init__(self, keyframe=900):
+        self.keyframe = keyframe
+        self.snapshots = {}
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def start(self):
+        """To be called at the beginning of every poll"""
+        self.seen = set()
+
+    def known(self, uuid):
+        """True if a record of the uuid has been written and it has not ended"""
+        return uuid in self.snapshots
+
+    def changed(self, record, now=None):
+        """Whether the live record has to be written, remembering it if so
+
+        Args:
+            record (dict): live record of a meeting as written to the log
+            now (float): epoch of the poll
+
+        Returns:
+            bool: True if the record has to be written
+        """
+        now = now if now is not None else timeutil.now()
+        uuid = record['uuid']
+        self.seen.add(uuid)
+        signature = tuple(record[field] for field in self.FIELDS)
+        previous = self.snapshots.get(uuid)
+        if previous and previous[0] == signature and now - previous[1] < self.keyframe:
+            return False
+        self.snapshots[uuid] = (signature, now, record)
+        return True
+
+    def ended(self, start_time):
+        """Records of the meetings written before and not seen in this poll, which are forgotten.
+        Only to be called once the whole poll went through.
+
+        Args:
+            start_time (str): UTC date of the poll
+
+        Returns:
+            list: a list of ended records
+        """
+        records = []
+        for uuid in [uuid for uuid in self.snapshots if uuid not in self.seen]:
+            last = self.snapshots.pop(uuid)[2]
+            records.append({
+                "type": last["type"],
+                "participants": 0,
+                "uuid": uuid,
+                "zoomid": last["zoomid"],
+                "topic": last["topic"],
+                "ended": 1,
+                "start_time": start_time
+            })
+        return records
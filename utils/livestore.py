@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+import threading
+
+from utils.helper import dumps
+from utils import timeutil
+
+
+class Document:
+    """A json document serialized once, with its ETag and, when first asked for, its gzip body"""
+
+    def __init__(self, content):
+        self.body = dumps(content).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class LiveStore:
+    """Latest live snapshot of each collector, summary and per event records, kept in memory
+    for the http api of app.py.
+
+    Documents are serialized when a snapshot is published, once per iteration, so serving
+    them is only a lookup, and an unchanged snapshot keeps its ETag.
+
+    Paths:
+        live: the summaries of every collector
+        live/<meetings|webinars>: summary and records of a collector
+        live/<meetings|webinars>/summary: summary of a collector
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.documents = {'live': Document({})}
+
+    def publish(self, kind, summary, records):
+        """Replace the snapshot of a collector
+
+        Args:
+            kind (str): meetings or webinars
+            summary (dict): summary record of the iteration, see LiveAggregator.summary
+            records (list): live record of every event
+        """
+        snapshot = {'updated': timeutil.now_iso(), 'summary': summary, 'records': records}
+        documents = {
+            'live/{}'.format(kind): Document(snapshot),
+            'live/{}/summary'.format(kind): Document({'updated': snapshot['updated'], 'summary': summary}),
+        }
+        with self.lock:
+            self.snapshots[kind] = snapshot
+            summaries = {name: {'updated': s['updated'], 'summary': s['summary']} for name, s in self.snapshots.items()}
+            documents['live'] = Document(summaries)
+            self.documents.update(documents)
+
+    def get(self, path):
+        """Document of a path, None if nothing was published there"""
+        with self.lock:
+            return self.documents.get(path)
+
+
+# store of this process, filled by the live collectors when they are given it
+store = LiveStore()
@@ -0,0 +1,140 @@
+import threading
+
+# seconds, for the latency of the api calls and the duration of the iterations
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for name, value in zip(names, values)))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} expects the labels {}".format(self.name, self.labelnames))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return ['{}{} {}'.format(self.name, _labels(self.labelnames, key), repr(float(value)))]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # a count per bucket, then the sum and the count of the observations
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self, key, counts):
+        names = self.labelnames + ('le',)
+        samples = ['{}_bucket{} {}'.format(self.name, _labels(names, key + (repr(float(bound)),)), counts[i])
+                   for i, bound in enumerate(self.buckets)]
+        samples.append('{}_bucket{} {}'.format(self.name, _labels(names, key + ('+Inf',)), counts[-1]))
+        samples.append('{}_sum{} {}'.format(self.name, _labels(self.labelnames, key), repr(float(counts[-2]))))
+        samples.append('{}_count{} {}'.format(self.name, _labels(self.labelnames, key), counts[-1]))
+        return samples
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format by the /metrics route of app.py"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+API_SECONDS = registry.histogram('zoom_api_request_seconds', 'Latency of the Zoom api calls, waits of the rate limiter excluded',
+                                 ('endpoint',))
+API_RESPONSES = registry.counter('zoom_api_responses_total', 'Zoom api responses by status code', ('endpoint', 'code'))
+PAGES = registry.counter('zoom_api_pages_total', 'Pages fetched from the paginated Zoom endpoints', ('key',))
+RATELIMIT_SLEEP = registry.counter('zoom_ratelimit_sleep_seconds_total', 'Seconds slept waiting for the rate limit budget',
+                                   ('category',))
+RECORDS_WRITTEN = registry.counter('zoom_records_written_total', 'Records written to the log files', ('log',))
+BYTES_WRITTEN = registry.counter('zoom_bytes_written_total', 'Bytes written to the log files', ('log',))
+ITERATION_SECONDS = registry.histogram('zoom_collector_iteration_seconds', 'Duration of the collector iterations',
+                                       ('collector',))
+LAST_ITERATION = registry.gauge('zoom_collector_last_iteration_seconds', 'Duration of the last iteration of a collector',
+                                ('collector',))
+INTERVAL = registry.gauge('zoom_collector_interval_seconds', 'Interval the collector iterations should fit in',
+                          ('collector',))
+OVERRUNS = registry.counter('zoom_collector_overruns_total', 'Iterations that took longer than the interval',
+                            ('collector',))
+FAILURES = registry.counter('zoom_collector_failures_total', 'Iterations that failed', ('collector',))
+DEDUP_ENTRIES = registry.gauge('zoom_collector_dedup_entries', 'Entries of the dedup maps of a collector',
+                               ('collector', 'map'))
@@ -1,14 +1,27 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
+from utils.credentials import TokenCache, IdentityCache
 from config import KEYCLOAK_API_TOKEN_ENDPOINT, KEYCLOAK_ENDPOINT, AUTHZSVC_ENDPOINT, CLIENT_SECRET, CLIENT_ID, AUTHZ_ENDPOINT
 
 logger = logging.getLogger('zoom-dashboard')
 
 class Openid:
-    def __init__(self):
-        token_resp = requests.post(
+    def __init__(self, pool_size=10):
+        # one session, so every page and call reuses the connections
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        # the token is shared with the other processes and refreshed before it expires
+        self.tokens = TokenCache('keycloak-authz', self._fetch_token)
+        self.identities = IdentityCache()
+
+    def _fetch_token(self):
+        token_resp = self.session.post(
             KEYCLOAK_API_TOKEN_ENDPOINT,
             data={
                 "grant_type": "client_credentials",
@@ -18,21 +31,37 @@ class Openid:
             },
             headers={"Content-Type": "application/x-www-form-urlencoded"},
         )
-        self.token=token_resp.json()['access_token']
-        
-    
-        
+        token_resp.raise_for_status()
+        body = token_resp.json()
+        return body['access_token'], body.get('expires_in', 300)
+
+    def close(self):
+        self.session.close()
+        self.identities.close()
+
+    @property
+    def token(self):
+        return self.tokens.get()
+
+    def _request(self, method, url, **kwargs):
+        """Request to the authorization service, getting a new token and retrying once on a 401"""
+        token = self.token
+        response = self.session.request(method, url, headers={"Authorization": "Bearer {}".format(token)}, **kwargs)
+        if response.status_code == 401:
+            logger.info('token refused by {}, getting a new one'.format(url))
+            self.tokens.invalidate(token)
+            response = self.session.request(method, url, headers={"Authorization": "Bearer {}".format(self.token)}, **kwargs)
+        return response
+
     def get_group_id(self, group):
-        my_group = requests.get(
-            "{0}Group/{1}".format(AUTHZSVC_ENDPOINT,group),
-            headers={
-            "Authorization": "Bearer {}".format(self.token),
-            }
+        my_group = self._request(
+            'GET',
+            "{0}Group/{1}".format(AUTHZSVC_ENDPOINT,group)
         )
         return my_group.json()["data"]["id"]
     
     def get_identity(self, zoomaccount):
-        """Retrieve the id link to a upn.
+        """Retrieve the id link to a upn, from the identity cache if it was retrieved lately.
 
         Args:
             zoomaccount ([string]): e.g. zsub01
@@ -40,25 +69,26 @@ class Openid:
         Returns:
             [string]: [id]
         """
-        response = requests.get(
-            "{0}Identity/{1}".format(AUTHZSVC_ENDPOINT, zoomaccount),
-            headers={
-            "Authorization": "Bearer {}".format(self.token),
-            }
+        identity = self.identities.get(zoomaccount)
+        if identity:
+            return identity
+        response = self._request(
+            'GET',
+            "{0}Identity/{1}".format(AUTHZSVC_ENDPOINT, zoomaccount)
         ) 
         if response.status_code == 200:
-            logger.info('identity {} for account {}'.format(response.json()['data']['id'], zoomaccount))
-            return response.json()['data']['id']
+            identity = response.json()['data']['id']
+            logger.info('identity {} for account {}'.format(identity, zoomaccount))
+            self.identities.update({zoomaccount: identity})
+            return identity
         else:
             logger.warn('we couldnt retrieve identity for {} error: {}'.format(zoomaccount, response.reason))
         return None
     
     def add_id_to_group(self, groupid, identity):
-        response = requests.post(
-            "{0}Group/{1}/memberidentities?ids={2}".format(AUTHZSVC_ENDPOINT, groupid, identity),
-            headers={
-            "Authorization": "Bearer {}".format(self.token),
-            }
+        response = self._request(
+            'POST',
+            "{0}Group/{1}/memberidentities?ids={2}".format(AUTHZSVC_ENDPOINT, groupid, identity)
         )
         if response.status_code == 200:
             return response.json()
@@ -67,11 +97,9 @@ class Openid:
             raise HTTPError("Unexpected status code {} - {}".format(response.status_code, response.json()))
         
     def remove_id_from_group(self, groupid, identity):
-        response = requests.delete(
-            "{0}Group/{1}/memberidentities?ids={2}".format(AUTHZSVC_ENDPOINT, groupid, identity),
-            headers={
-            "Authorization": "Bearer {}".format(self.token),
-            }
+        response = self._request(
+            'DELETE',
+            "{0}Group/{1}/memberidentities?ids={2}".format(AUTHZSVC_ENDPOINT, groupid, identity)
         )
         if response.status_code == 200:
             return response.json()
@@ -80,33 +108,76 @@ class Openid:
             raise HTTPError("Unexpected status code {} - {}".format(response.status_code, response.json()))
 
 
-    def get_allmembers(self, groupid, members, fields=None, url=None):
+    def add_ids_to_group(self, groupid, identities, chunk_size=50):
+        """Add several identities to a group, chunk_size of them per request"""
+        self._change_group_ids('POST', groupid, identities, chunk_size)
+
+    def remove_ids_from_group(self, groupid, identities, chunk_size=50):
+        """Remove several identities from a group, chunk_size of them per request"""
+        self._change_group_ids('DELETE', groupid, identities, chunk_size)
+
+    def _change_group_ids(self, method, groupid, identities, chunk_size):
+        for i in range(0, len(identities), chunk_size):
+            chunk = identities[i:i + chunk_size]
+            response = self._request(
+                method,
+                "{0}Group/{1}/memberidentities".format(AUTHZSVC_ENDPOINT, groupid),
+                params=[('ids', identity) for identity in chunk]
+            )
+            if response.status_code != 200:
+                logger.warn('{} identities: {} in group: {} failed reason: {} http code: {}'.format(method, chunk, groupid, response.reason, response.status_code))
+                raise HTTPError("Unexpected status code {} - {}".format(response.status_code, response.text))
+            logger.debug('{} {} identities in group {}'.format(method, len(chunk), groupid))
+
+    def iter_members(self, groupid, fields=None, url=None):
+        """Iterate over the members of a group, following the pages one after the other.
+
+        Args:
+            groupid (str): id of the group
+            fields (list): fields of the members to retrieve e.g. ['upn', 'primaryAccountEmail']
+            url (str): next link of a previous listing to resume from
+
+        Yields:
+            dict: a member
+        """
+        params = None
         if not url:
-            url= "{0}Group/{1}/memberidentities".format(AUTHZSVC_ENDPOINT,groupid)
-        else:
-            urlparts=url.split('Group')
-            url="{0}Group{1}".format(AUTHZSVC_ENDPOINT,urlparts[1])
-            logger.debug("url is {}".format(url))     
-
-        if fields:
-            toadd=''
-            for item in fields:
-                if not toadd:
-                    toadd='field={}'.format(item)
-                    continue
-                toadd += '&field={}'.format(item)
-            url='{0}?{1}'.format(url,toadd)
-
-        response = requests.get(
-            url,
-            headers={
-            "Authorization": "Bearer {}".format(self.token),
-            }
-        )
-        if response.status_code == 200:
-            for item in response.json()['data']:
-                members.append(item)
-        if response.json()['pagination']['links']['next']:
-            logger.debug("next link: {}".format(response.json()['pagination']['links']['next']))
-            self.get_allmembers(groupid,members,url=response.json()['pagination']['links']['next'])
-        return
\ No newline at end of file
+            url = "{0}Group/{1}/memberidentities".format(AUTHZSVC_ENDPOINT, groupid)
+            params = [('field', field) for field in fields or []]
+        while url:
+            response = self._request(
+                'GET',
+                url,
+                params=params
+            )
+            if response.status_code != 200:
+                logger.warn('members of group: {} couldnt be retrieved reason: {} http code: {}'.format(groupid, response.reason, response.status_code))
+                raise HTTPError("Unexpected status code {} - {}".format(response.status_code, response.text))
+            body = response.json()
+            self.identities.update({item['upn']: item['id'] for item in body['data'] if item.get('upn') and item.get('id')})
+            for item in body['data']:
+                yield item
+            url = body['pagination']['links']['next']
+            if url:
+                # the next link carries the query, but not our endpoint
+                url = "{0}Group{1}".format(AUTHZSVC_ENDPOINT, url.split('Group', 1)[1])
+                logger.debug("next link: {}".format(url))
+                params = None
+
+    def get_allmembers(self, groupid, members, fields=None, url=None):
+        members.extend(self.iter_members(groupid, fields=fields, url=url))
+
+    def get_groups_members(self, groupids, fields=None, concurrency=4):
+        """Retrieve the members of several groups at once
+
+        Args:
+            groupids (list): ids of the groups
+            fields (list): fields of the members to retrieve
+            concurrency (int): number of groups listed at the same time
+
+        Returns:
+            dict: groupid: list of members
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(groupids)))) as executor:
+            lists = executor.map(lambda groupid: list(self.iter_members(groupid, fields=fields)), groupids)
+            return dict(zip(groupids, lists))
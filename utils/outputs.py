@@ -0,0 +1,333 @@
+import csv
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+from utils.helper import RecordWriter, dumps
+from utils.archive import ArchiveSink, ARCHIVED
+from config import LOG_DIR
+
+logger = logging.getLogger('zoom-dashboard')
+
+# document_type set by filebeat.yml to the records of each log file
+DOCUMENT_TYPES = {
+    'pasticipants.log': 'zparticipants',
+    'live.log': 'aggrzeventslive',
+    'past.log': 'zeventspast',
+    'rollup.log': 'zrollups',
+}
+
+SPOOL_DIR = os.path.join(LOG_DIR, 'spool')
+
+# marker put in the queue of a BulkHTTPSink to send what is pending right away
+_FLUSH = object()
+
+
+def document_type(log_file_name):
+    for suffix, doctype in DOCUMENT_TYPES.items():
+        if log_file_name.endswith(suffix):
+            return doctype
+    return log_file_name.split('.')[0]
+
+
+class MultiSink:
+    """Sends every record to several outputs e.g. the log file and Elasticsearch"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class BulkHTTPSink:
+    """Output sending records in bulk requests straight to Elasticsearch or Logstash.
+
+    Records are queued (write blocks when the queue is full, so a slow backend slows
+    down the collector instead of eating its memory) and a background thread sends
+    them when batch_size records or max_bytes are reached, or flush_interval seconds
+    after the first one. Failed requests are retried with backoff and, if the backend
+    is still down, the batch goes to a bounded spool directory to be resent later.
+    From then on the backend counts as down: batches go straight to the spool, and
+    every probe_interval seconds, busy or idle, the oldest spooled batch is resent to
+    probe it. Batches spooled by a previous process are resent the same way.
+
+    With bulk_format ndjson the body is sent as application/x-ndjson, which the
+    Logstash http input only splits in events with a json_lines codec for it:
+
+        http { additional_codecs => { "application/x-ndjson" => "json_lines" } }
+
+    Args:
+        url (str): Elasticsearch base url, or the url of a Logstash http input
+        name (str): Name of the output, e.g. the log file name, used for the spool files
+        fields (dict): Fields added to every record, e.g. {'fields': {'document_type': ...}} as filebeat.yml
+            sets them, under fields since it doesn't use fields_under_root
+        doctype (str): document_type expanded in index, the name by default
+        bulk_format (str): 'elasticsearch' for the _bulk API, 'ndjson' for one json per line
+        index (str): Elasticsearch index, strftime and {document_type} are expanded
+        batch_size (int): Maximum number of records per request
+        max_bytes (int): Maximum size of a request
+        flush_interval (float): Seconds a record can wait for a batch to fill up
+        retries (int): Attempts before spooling a batch
+        probe_interval (float): Seconds between attempts to resend the spool while the backend is down
+        spool_dir (str): Where batches are kept while the backend is down
+        spool_max_bytes (int): Size of the spool, the oldest batches are dropped beyond it
+        maxsize (int): Size of the queue
+        timeout (float): Timeout of the requests
+    """
+
+    def __init__(self, url, name, fields=None, doctype=None, bulk_format='elasticsearch', index='zoom-{document_type}-%Y.%m.%d',
+                 batch_size=500, max_bytes=5 * 1024 * 1024, flush_interval=5.0, retries=5, probe_interval=30.0,
+                 spool_dir=SPOOL_DIR, spool_max_bytes=500 * 1024 * 1024, maxsize=10000, timeout=30):
+        self.url = url.rstrip('/')
+        self.name = name
+        self.fields = fields or {}
+        self.doctype = doctype or name
+        self.bulk_format = bulk_format
+        self.index = index
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.probe_interval = probe_interval
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.timeout = timeout
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        self.session = requests.Session()
+        self.queue = queue.Queue(maxsize)
+        # batches left by a previous run, e.g. a pod restarted while the backend was down
+        self.spooled = len(self._spool_files())
+        self.down = False
+        self.last_probe = 0
+        self.thread = threading.Thread(target=self._run, name='bulk-{}'.format(name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, record):
+        """Queue a record (dict) to be sent"""
+        self.queue.put(record)
+
+    def flush(self):
+        """Block until all the records written so far are sent or spooled"""
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.session.close()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.probe_interval if self.spooled else None)
+            except queue.Empty:
+                # idle, a good time to retry the spool
+                self._retry_spool()
+                continue
+            taken = 1
+            lines = []
+            size = 0
+            deadline = time.time() + self.flush_interval
+            while item is not None and item is not _FLUSH:
+                line = self._line(item)
+                lines.append(line)
+                size += len(line)
+                if len(lines) >= self.batch_size or size >= self.max_bytes:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                taken += 1
+            try:
+                if lines:
+                    self._send_or_spool(self._payload(lines))
+                self._retry_spool()
+            except Exception:
+                logger.exception("Bulk output {} failed".format(self.name))
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+            if item is None:
+                return
+
+    def _line(self, record):
+        if self.fields:
+            record = dict(record, **self.fields)
+        return dumps(record)
+
+    def _payload(self, lines):
+        if self.bulk_format == 'elasticsearch':
+            action = dumps({'index': {'_index': time.strftime(
+                self.index.format(document_type=self.doctype), time.gmtime())}})
+            lines = [part for line in lines for part in (action, line)]
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def _post(self, payload):
+        """Send a payload, True if the backend took it"""
+        if self.bulk_format == 'elasticsearch':
+            url = '{}/_bulk'.format(self.url)
+        else:
+            url = self.url
+        content_type = 'application/x-ndjson'
+        try:
+            response = self.session.post(url, data=payload, headers={'Content-Type': content_type}, timeout=self.timeout)
+        except requests.exceptions.RequestException as ex:
+            logger.warn("Bulk output {} could not reach {}: {}".format(self.name, url, ex))
+            return False
+        if response.status_code in (429, 502, 503, 504):
+            return False
+        if response.status_code >= 400:
+            # not something a retry fixes, e.g. a mapping error
+            logger.error("Bulk output {} rejected with {}: {}".format(self.name, response.status_code, response.text[:500]))
+            return True
+        if self.bulk_format == 'elasticsearch':
+            body = response.json()
+            if body.get('errors'):
+                failed = [item for item in body.get('items', []) if item.get('index', {}).get('status', 200) >= 300]
+                logger.error("Bulk output {}: {} documents failed e.g. {}".format(self.name, len(failed), failed[:1]))
+        return True
+
+    def _send_or_spool(self, payload):
+        if self.down:
+            self._spool(payload)
+            return False
+        for attempt in range(self.retries):
+            if self._post(payload):
+                return True
+            time.sleep(min(30, 2 ** attempt))
+        # no more waiting on every batch, _retry_spool probes the backend
+        self.down = True
+        self.last_probe = time.time()
+        self._spool(payload)
+        return False
+
+    def _retry_spool(self):
+        try:
+            if not self.spooled or (self.down and time.time() - self.last_probe < self.probe_interval):
+                return
+            self.last_probe = time.time()
+            self.down = not self._resend_spool()
+            if not self.down:
+                logger.info("Bulk output {} backend back, spool resent".format(self.name))
+        except Exception:
+            logger.exception("Bulk output {} failed to resend its spool".format(self.name))
+
+    def _spool_files(self):
+        return sorted(glob.glob(os.path.join(self.spool_dir, '{}-*.ndjson'.format(self.name))))
+
+    def _spool(self, payload):
+        path = os.path.join(self.spool_dir, '{}-{:.6f}.ndjson'.format(self.name, time.time()))
+        with open(path, 'wb') as f:
+            f.write(payload)
+        self.spooled += 1
+        files = self._spool_files()
+        total = sum(os.path.getsize(f) for f in files)
+        while files and total > self.spool_max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            self.spooled = max(0, self.spooled - 1)
+            logger.error("Bulk output {} spool full, dropped {}".format(self.name, oldest))
+        logger.warn("Bulk output {} backend down, batch spooled to {}".format(self.name, path))
+
+    def _resend_spool(self):
+        """Send the spooled batches, oldest first, stopping at the first failure
+
+        Returns:
+            bool: True if the spool is empty
+        """
+        for path in self._spool_files():
+            with open(path, 'rb') as f:
+                payload = f.read()
+            if not self._post(payload):
+                return False
+            os.remove(path)
+            self.spooled = max(0, self.spooled - 1)
+        self.spooled = 0
+        return True
+
+
+def sink_factory(output='file', bulk_url=None, bulk_format='elasticsearch', bulk_index='zoom-{document_type}-%Y.%m.%d',
+                 flush_interval=1.0, fsync_interval=0, archive=False):
+    """Build the function giving the output of each log file of the collectors
+
+    Args:
+        output (str): 'file' for the log files, 'bulk' to send straight to bulk_url, 'both' for both
+        archive (bool): also write the past events and participants to the parquet archive, see utils.archive
+
+    Returns:
+        function: log_file_name -> object with write(record), flush() and close()
+    """
+    def factory(log_file_name):
+        sinks = []
+        if output in ('file', 'both'):
+            sinks.append(RecordWriter(log_file_name, flush_interval=flush_interval, fsync_interval=fsync_interval))
+        if output in ('bulk', 'both'):
+            doctype = document_type(log_file_name)
+            sinks.append(BulkHTTPSink(bulk_url, log_file_name, fields={'fields': {'document_type': doctype}},
+                                      doctype=doctype, bulk_format=bulk_format, index=bulk_index))
+        if archive and log_file_name in ARCHIVED:
+            sinks.append(ArchiveSink(log_file_name))
+        return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+    return factory
+
+
+STREAM_FORMATS = ('ndjson', 'json', 'csv')
+
+
+def write_pages(pages, stream, output_format='ndjson'):
+    """Write the records of the pages of a listing as they arrive, flushing after every page,
+    so only one page is held in memory whatever the size of the listing.
+
+    Args:
+        pages (iterator): lists of records e.g. from iter_pages
+        stream (file): where to write, e.g. stdout
+        output_format (str): ndjson, one record per line; json, a single array, closed even if
+            pages raises; csv, with the fields of the first record as header and nested values as json
+
+    Returns:
+        int: number of records written
+    """
+    count = 0
+    writer = None
+    if output_format == 'json':
+        stream.write('[')
+    try:
+        for page in pages:
+            for record in page:
+                if output_format == 'csv':
+                    if writer is None:
+                        writer = csv.DictWriter(stream, fieldnames=list(record), extrasaction='ignore')
+                        writer.writeheader()
+                    writer.writerow({k: dumps(v) if isinstance(v, (dict, list)) else v for k, v in record.items()})
+                elif output_format == 'json':
+                    stream.write('{}\n{}'.format(',' if count else '', dumps(record)))
+                else:
+                    stream.write(dumps(record))
+                    stream.write('\n')
+                count += 1
+            stream.flush()
+    finally:
+        # the array stays valid json when the listing fails half way
+        if output_format == 'json':
+            stream.write(']\n')
+            stream.flush()
+    return count
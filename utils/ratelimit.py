@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+from utils.filelock import FileLock
+from utils import timeutil
+from utils.metrics import RATELIMIT_SLEEP
+from config import LOG_DIR
+
+logger = logging.getLogger('zoom-dashboard')
+
+# Zoom rate limit categories: (requests per second, burst). These are only the
+# starting values, they get adjusted with the X-RateLimit-* headers Zoom returns.
+RATE_LIMITS = {
+    'light': (80.0, 80.0),
+    'medium': (60.0, 60.0),
+    'heavy': (40.0, 40.0),
+    'resource-intensive': (20.0, 20.0),
+}
+
+STATE_FILE = os.path.join(LOG_DIR, 'zoom-ratelimit.json')
+
+
+def _parse_retry_after(value, now):
+    """Retry-After comes either as seconds or as a date e.g. for the daily limits.
+
+    Args:
+        value (str): value of the header
+        now (float): current epoch
+
+    Returns:
+        float: epoch until we are not allowed to call the API, None if it cannot be parsed
+    """
+    value = value.strip()
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    try:
+        return float(timeutil.parse_epoch(value))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed:
+        return float(mktime_tz(parsed))
+    return None
+
+
+class RateLimiter(object):
+    """Token bucket per Zoom rate limit category.
+
+    The buckets live in a small json file protected by a lock, so every collector
+    using the same state file, even from different processes, shares one budget.
+
+    Args:
+        state_file (str): path of the json file keeping the buckets
+        limits (dict): category: (requests per second, burst), defaults to RATE_LIMITS
+    """
+
+    def __init__(self, state_file=STATE_FILE, limits=None):
+        self.state_file = state_file
+        self.limits = dict(RATE_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.lock = FileLock('{}.lock'.format(state_file))
+
+    def _load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, state):
+        tmp = '{}.{}.tmp'.format(self.state_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp, self.state_file)
+
+    def _bucket(self, state, category, now):
+        rate, burst = self.limits.get(category, self.limits['light'])
+        bucket = state.setdefault(category, {
+            'rate': rate,
+            'burst': burst,
+            'tokens': burst,
+            'updated': now,
+            'blocked_until': 0
+        })
+        elapsed = max(0.0, now - bucket['updated'])
+        bucket['tokens'] = min(bucket['burst'], bucket['tokens'] + elapsed * bucket['rate'])
+        bucket['updated'] = now
+        return bucket
+
+    def acquire(self, category):
+        """Block until a request of the category fits in the budget.
+
+        Args:
+            category (str): Zoom rate limit category e.g. heavy
+
+        Returns:
+            float: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                state = self._load()
+                bucket = self._bucket(state, category, now)
+                if bucket['blocked_until'] > now:
+                    wait = bucket['blocked_until'] - now
+                elif bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    self._save(state)
+                    return waited
+                else:
+                    wait = (1 - bucket['tokens']) / bucket['rate']
+                self._save(state)
+            if wait > 1:
+                logger.warn("Rate limit for {} reached, waiting {:.1f}s".format(category, wait))
+            time.sleep(wait)
+            waited += wait
+            RATELIMIT_SLEEP.inc(wait, category=category)
+
+    def update(self, category, response):
+        """Adjust the bucket of the category with what Zoom tells us in the response.
+
+        Args:
+            category (str): Zoom rate limit category of the request
+            response (requests.Response): response to the request
+        """
+        headers = response.headers
+        limit_type = headers.get('X-RateLimit-Type', '')
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        retry_after = headers.get('Retry-After')
+        if response.status_code != 429 and not limit and not retry_after:
+            return
+        with self.lock:
+            now = time.time()
+            state = self._load()
+            bucket = self._bucket(state, category, now)
+            if limit and limit_type.upper() == 'QPS':
+                bucket['rate'] = bucket['burst'] = float(limit)
+            if remaining is not None and remaining.isdigit() and limit_type.upper() == 'QPS':
+                bucket['tokens'] = min(bucket['tokens'], float(remaining))
+            if response.status_code == 429 or remaining == '0':
+                bucket['tokens'] = 0
+                blocked_until = _parse_retry_after(retry_after, now) if retry_after else None
+                if blocked_until is None:
+                    if limit_type.lower() == 'daily-limit':
+                        # daily limits are reset at midnight UTC
+                        blocked_until = (now // 86400 + 1) * 86400
+                    else:
+                        blocked_until = now + 1
+                bucket['blocked_until'] = max(bucket['blocked_until'], blocked_until)
+                logger.warn("Zoom rate limit hit for {} ({}), blocked until {}".format(
+                    category, limit_type or response.status_code,
+                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(bucket['blocked_until']))))
+            self._save(state)
@@ -0,0 +1,74 @@
+import calendar
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from functools import lru_cache
+
+# format of the dates returned by Zoom e.g. 2020-11-24T10:00:00Z
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_local = threading.local()
+
+
+@lru_cache(maxsize=65536)
+def parse_epoch(date_string):
+    """Epoch of a UTC date string as returned by Zoom.
+
+    The fixed layout is sliced instead of going through strptime, anything else
+    falls back to it, and the results are memoized as the same start, join and
+    leave times come back again and again.
+
+    Args:
+        date_string (str): UTC date e.g. 2020-11-24T10:00:00Z
+
+    Returns:
+        int: seconds since the epoch
+
+    Raises:
+        ValueError: if it is not a date in ISO_FORMAT
+    """
+    if len(date_string) == 20 and date_string[4] == '-' and date_string[7] == '-' and date_string[10] == 'T' \
+            and date_string[13] == ':' and date_string[16] == ':' and date_string[19] == 'Z':
+        try:
+            hour, minute, second = int(date_string[11:13]), int(date_string[14:16]), int(date_string[17:19])
+            days = date(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10])).toordinal()
+        except ValueError:
+            days = None
+        if days is not None and hour < 24 and minute < 60 and second < 62:
+            return (days - _EPOCH_ORDINAL) * 86400 + hour * 3600 + minute * 60 + second
+    return calendar.timegm(time.strptime(date_string, ISO_FORMAT))
+
+
+@lru_cache(maxsize=1024)
+def iso(epoch):
+    """UTC date string, as Zoom returns them, of an epoch in seconds"""
+    return time.strftime(ISO_FORMAT, time.gmtime(epoch))
+
+
+def now():
+    """Current epoch, the same for the whole iteration when called within frozen_now"""
+    frozen = getattr(_local, 'now', None)
+    return frozen if frozen is not None else time.time()
+
+
+def now_iso():
+    """UTC date string of now()"""
+    return iso(int(now()))
+
+
+@contextmanager
+def frozen_now():
+    """Freeze now() in this thread, so one iteration uses a single clock reading
+
+        with timeutil.frozen_now():
+            collector.run_once()
+    """
+    previous = getattr(_local, 'now', None)
+    _local.now = time.time()
+    try:
+        yield _local.now
+    finally:
+        _local.now = previous
@@ -0,0 +1,190 @@
+import cProfile
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from utils.helper import RecordWriter
+from utils import timeutil
+from config import LOG_DIR
+
+logger = logging.getLogger('zoom-dashboard')
+
+TRACE_LOG = 'zoom-trace.log'
+PROFILE_DIR = os.path.join(LOG_DIR, 'profiles')
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _trace_writer():
+    # one writer for every tracer of the process, they share the log file
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = RecordWriter(TRACE_LOG)
+        return _writer
+
+
+class _Stage:
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        seconds, calls = self.stages.get(self.name, (0.0, 0))
+        self.stages[self.name] = (seconds + elapsed, calls + 1)
+        return False
+
+
+class _NullStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Tracer:
+    """Timing spans of the stages of each iteration of a job, e.g. fetch, aggregate, dedup and write,
+    written as json records to LOG_DIR/zoom-trace.log, one per stage and iteration:
+
+        {"trace": "meetings-live", "iteration": 12, "span": "fetch", "seconds": 2.1, "calls": 11, ...}
+
+    A stage can be entered many times in an iteration, its time and calls are summed up, so
+    timing every page or item costs two clock readings and no record.
+
+    Every profile_every iterations, the iteration also runs under cProfile, dumped to
+    LOG_DIR/profiles/<name>-<iteration>.prof (see python -m pstats), and a tracemalloc snapshot
+    is compared with the previous one, the memory record gets the lines that grew the most.
+
+    Args:
+        name (str): Name of the job, e.g. the collector name
+        trace (bool): Write the spans, otherwise stage() costs nothing
+        profile_every (int): Iterations between profiles, 0 to never profile
+        top (int): Lines of the tracemalloc comparison to keep
+    """
+
+    def __init__(self, name, trace=False, profile_every=0, top=10):
+        self.name = name
+        self.trace = trace
+        self.profile_every = profile_every
+        self.top = top
+        self.iterations = 0
+        self.stages = {}
+        self.snapshot = None
+        self.writer = _trace_writer() if trace or profile_every else None
+        if profile_every:
+            if not os.path.isdir(PROFILE_DIR):
+                os.makedirs(PROFILE_DIR)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @property
+    def enabled(self):
+        return self.writer is not None
+
+    def stage(self, name):
+        """Context manager timing a stage of the current iteration"""
+        if not self.trace:
+            return _NULL_STAGE
+        return _Stage(self.stages, name)
+
+    def iterate(self, name, iterable):
+        """Iterate timing each next() as the stage name, e.g. the pages of a listing"""
+        if not self.trace:
+            return iterable
+        return self._iterate(name, iterable)
+
+    def _iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @contextmanager
+    def iteration(self, **attributes):
+        """Wrap one iteration, writing its spans at the end, profiled every profile_every of them
+
+        Args:
+            attributes: added to the records of the iteration, e.g. the events retrieved
+        """
+        if not self.enabled:
+            yield attributes
+            return
+        self.iterations += 1
+        self.stages = {}
+        profiler = None
+        profiling = self.profile_every and self.iterations % self.profile_every == 0
+        if profiling:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # only one profiler at a time, e.g. another collector of the daemon is being profiled
+                logger.warn("{} iteration {} not profiled, a profiler is already running".format(self.name, self.iterations))
+                profiler = None
+        started = time.perf_counter()
+        start_time = timeutil.now_iso()
+        try:
+            yield attributes
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler:
+                profiler.disable()
+                self._dump(profiler)
+            if profiling:
+                self._memory()
+            if self.trace:
+                self._spans(start_time, elapsed, attributes)
+
+    def _record(self, span, start_time, **fields):
+        record = {'trace': self.name, 'iteration': self.iterations, 'span': span, 'start_time': start_time}
+        record.update(fields)
+        self.writer.write(record)
+
+    def _spans(self, start_time, elapsed, attributes):
+        self._record('iteration', start_time, seconds=round(elapsed, 6), calls=1, **attributes)
+        for stage, (seconds, calls) in sorted(self.stages.items()):
+            self._record(stage, start_time, seconds=round(seconds, 6), calls=calls)
+
+    def _dump(self, profiler):
+        path = os.path.join(PROFILE_DIR, '{}-{}.prof'.format(self.name, self.iterations))
+        profiler.dump_stats(path)
+        logger.info("{} iteration {} profiled in {}".format(self.name, self.iterations, path))
+
+    def _memory(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        growth = []
+        if self.snapshot is not None:
+            for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+                frame = stat.traceback[0]
+                growth.append({'line': '{}:{}'.format(frame.filename, frame.lineno),
+                               'size': stat.size, 'size_diff': stat.size_diff, 'count_diff': stat.count_diff})
+        self.snapshot = snapshot
+        self._record('memory', timeutil.now_iso(), current=current, peak=peak, growth=growth)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+
+# a tracer doing nothing, for the jobs run without --trace or --profile
+NULL_TRACER = Tracer('null')
@@ -1,13 +1,21 @@
 from __future__ import absolute_import, unicode_literals
+import asyncio
+import functools
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import jwt
 import contextlib
 from urllib.parse import quote
 from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 from pytz import utc
 
+from utils.ratelimit import RateLimiter
+from utils.metrics import API_SECONDS, API_RESPONSES, PAGES
+
 @contextlib.contextmanager
 def ignored(*exceptions):
     """Simple context manager to ignore expected Exceptions
@@ -46,31 +54,98 @@ def _handle_response(resp, expected_code=200, expects_json=True):
         return resp
 
 
+def iter_pages(fetch, key, **kwargs):
+    """Follow the next_page_token of a paginated endpoint, yielding each page as it arrives.
+    :param fetch: The :class:`ZoomAPIClient` method to call e.g. ``list_meetings``
+    :param key: The key holding the records of a page e.g. ``meetings``
+    :param kwargs: The parameters of the request, ``next_page_token`` is handled here
+    :returns: A generator of the list of records of each page
+    """
+    while True:
+        res = fetch(**kwargs)
+        PAGES.inc(key=key)
+        yield res.get(key, [])
+        if not res.get("next_page_token"):
+            break
+        kwargs["next_page_token"] = res["next_page_token"]
+
+
+async def aiter_pages(fetch, key, **kwargs):
+    """Async flavour of :func:`iter_pages` for the :class:`AsyncZoomAPIClient` methods."""
+    while True:
+        res = await fetch(**kwargs)
+        PAGES.inc(key=key)
+        yield res.get(key, [])
+        if not res.get("next_page_token"):
+            break
+        kwargs["next_page_token"] = res["next_page_token"]
+
+
 class APIException(Exception):
     pass
 
 
+class ZoomSession(Session):
+    """A long-lived :class:`requests.Session` shared by all the components of a
+    :class:`ZoomClient`, so connections are kept alive and reused between calls.
+    :param timeout: The default timeout applied to every request
+    :param pool_size: The number of connections to keep in the pool per host
+    """
+    def __init__(self, timeout=None, pool_size=10):
+        super(ZoomSession, self).__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers.update({
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive'
+        })
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(ZoomSession, self).request(method, url, **kwargs)
+
+
+# signed JWT of every api key: (token, expiry), shared by all the clients of the process
+_jwt_tokens = {}
+_jwt_lock = threading.Lock()
+
+
+def _jwt_token(api_key, api_secret, lifetime=3600, margin=300):
+    """JWT for the Zoom API, only signed again when the cached one is about to expire"""
+    now = time.time()
+    with _jwt_lock:
+        cached = _jwt_tokens.get(api_key)
+        if cached and now < cached[1] - margin:
+            return cached[0]
+        header = {"alg": "HS256", "typ": "JWT"}
+        payload = {"iss": api_key, "exp": int(now + lifetime)}
+        token = jwt.encode(payload, api_secret, algorithm="HS256", headers=header).decode("utf-8")
+        _jwt_tokens[api_key] = (token, now + lifetime)
+        return token
+
+
+def _jwt_invalidate(api_key):
+    with _jwt_lock:
+        _jwt_tokens.pop(api_key, None)
+
+
 class BaseComponent(object):
-    def __init__(self, base_uri, config, timeout):
+    def __init__(self, base_uri, config, timeout, session=None):
         self.base_uri = base_uri
         self.config = config
         self.timeout = timeout
+        self._session = session or ZoomSession(timeout=timeout)
 
     @property
     def token(self):
-        header = {"alg": "HS256", "typ": "JWT"}
-        payload = {"iss": self.config['api_key'], "exp": int(time.time() + 3600)}
-        token = jwt.encode(payload, self.config['api_secret'], algorithm="HS256", headers=header)
-        return token.decode("utf-8")
+        return _jwt_token(self.config['api_key'], self.config['api_secret'])
 
     @property
     def session(self):
-        session = Session()
-        session.headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer {}'.format(self.token)
-        }
-        return session
+        self._session.headers['Authorization'] = 'Bearer {}'.format(self.token)
+        return self._session
 
 def _require_keys(d, keys, allow_none=True):
     """Require that the object have the given keys
@@ -188,7 +263,7 @@ class UserComponent(BaseComponent):
         _require_keys(kwargs, "id")
         return self.session.get(
             "{}/users/{}/webinars".format(self.base_uri, kwargs.pop("id")),
-            json=kwargs,
+            params=kwargs,
         )
 
 
@@ -202,27 +277,35 @@ class ZoomClient(object):
         'webinar': WebinarComponent,
     }
 
-    def __init__(self, api_key, api_secret, base_url, timeout=15):
+    def __init__(self, api_key, api_secret, base_url, timeout=15, pool_size=10):
         """Create a new Zoom client.
         :param api_key: the Zoom JWT API key
         :param api_secret: the Zoom JWT API Secret
         :param timeout: the time out to use for API requests
+        :param pool_size: the number of pooled keep-alive connections
         """
         BASE_URI = base_url
 
         # Setup the config details
-        config = {
+        self.config = config = {
             "api_key": api_key,
             "api_secret": api_secret
         }
 
+        # One pooled session for all the components
+        self.session = ZoomSession(timeout=timeout, pool_size=pool_size)
+
         # Instantiate the components
 
         self.components = {
-            key: component(base_uri=BASE_URI, config=config, timeout=timeout)
+            key: component(base_uri=BASE_URI, config=config, timeout=timeout, session=self.session)
             for key, component in self._components.items()
         }
 
+    def refresh_token(self):
+        """Sign a new JWT on the next request, e.g. after a 401"""
+        _jwt_invalidate(self.config['api_key'])
+
     @property
     def metrics(self):
         """Get the metrics component."""
@@ -244,45 +327,132 @@ class ZoomClient(object):
         return self.components.get("webinar")
 
 class ZoomAPIClient(object):
-    def __init__(self, api_client, api_key, base_url):
+    def __init__(self, api_client, api_key, base_url, timeout=15, pool_size=10, rate_limiter=None, retries=3):
         self.client = ZoomClient(
             api_client,
             api_key,
-            base_url
+            base_url,
+            timeout=timeout,
+            pool_size=pool_size
         )
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retries = retries
+
+    def _call(self, category, request, expected_code=200, expects_json=True, endpoint=None):
+        """Do a request within the rate limit budget of its category, retrying if Zoom
+        still answers with a 429, and once with a new token on a 401.
+        :param category: Zoom rate limit category of the API e.g. heavy
+        :param request: callable doing the request and returning the response
+        :param endpoint: name of the API for the metrics e.g. list_meetings
+        """
+        endpoint = endpoint or category
+        refreshed = False
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(category)
+            started = time.time()
+            resp = request()
+            API_SECONDS.observe(time.time() - started, endpoint=endpoint)
+            API_RESPONSES.inc(endpoint=endpoint, code=str(resp.status_code))
+            self.rate_limiter.update(category, resp)
+            if resp.status_code == 401 and not refreshed:
+                # e.g. the token expired in the middle of a long run
+                self.client.refresh_token()
+                refreshed = True
+                continue
+            if resp.status_code != 429 or attempt == self.retries:
+                break
+            attempt += 1
+        return _handle_response(resp, expected_code, expects_json=expects_json)
 
     def list_meetings(self, **kwargs):
-        return _handle_response(self.client.metrics.list_meetings(**kwargs), 200)
+        return self._call('resource-intensive', lambda: self.client.metrics.list_meetings(**kwargs), 200, endpoint='list_meetings')
     
     def list_webinars(self, **kwargs):
-        return _handle_response(self.client.metrics.list_webinars(**kwargs), 200)
+        return self._call('resource-intensive', lambda: self.client.metrics.list_webinars(**kwargs), 200, endpoint='list_webinars')
 
     def get_meeting(self, meeting_id):
         data = {
             "meeting_id": meeting_id
         }
-        return _handle_response(self.client.metrics.get_meeting(data), 200)
+        return self._call('heavy', lambda: self.client.metrics.get_meeting(**data), 200, endpoint='get_meeting')
 
     def list_participants_meeting(self, **kwargs):
-        return _handle_response(self.client.metrics.list_participants_meeting(**kwargs), 200)
+        return self._call('resource-intensive', lambda: self.client.metrics.list_participants_meeting(**kwargs), 200, endpoint='list_participants_meeting')
 
     def list_participants_webinar(self, **kwargs):
-        return _handle_response(self.client.metrics.list_participants_webinar(**kwargs), 200)
+        return self._call('resource-intensive', lambda: self.client.metrics.list_participants_webinar(**kwargs), 200, endpoint='list_participants_webinar')
 
 
     def list_registrants_meeting(self, **kwargs):
-        return _handle_response(self.client.meeting.list_registrants_meeting(**kwargs), 200)
+        return self._call('medium', lambda: self.client.meeting.list_registrants_meeting(**kwargs), 200, endpoint='list_registrants_meeting')
 
     def add_registrant_meeting(self, meeting_id, **kwargs):
-        return _handle_response(self.client.meeting.add_registrant_meeting(meeting_id, **kwargs), 201)    
+        return self._call('light', lambda: self.client.meeting.add_registrant_meeting(meeting_id, **kwargs), 201, endpoint='add_registrant_meeting')    
     
     def set_webinar_addon(self,  **kwargs):
-        return _handle_response(self.client.user.update_settings(**kwargs), 204, expects_json=False)
+        return self._call('medium', lambda: self.client.user.update_settings(**kwargs), 204, expects_json=False, endpoint='set_webinar_addon')
 
     def list_user_webinars(self,  **kwargs):
-        return _handle_response(self.client.user.get_webinars(**kwargs), 200, expects_json=True)
+        return self._call('medium', lambda: self.client.user.get_webinars(**kwargs), 200, expects_json=True, endpoint='list_user_webinars')
 
     def get_webinar_details(self, **kwargs):
-        return _handle_response(self.client.webinar.get_webinar_details(**kwargs), 200, expects_json=True)
+        return self._call('light', lambda: self.client.webinar.get_webinar_details(**kwargs), 200, expects_json=True, endpoint='get_webinar_details')
+
+
+class AsyncZoomAPIClient(object):
+    """asyncio flavour of :class:`ZoomAPIClient`, with the same methods as coroutines.
+    Calls run on a thread pool over the pooled session and the shared rate limiter of a
+    :class:`ZoomAPIClient`, so at most ``concurrency`` requests are in flight at once.
+    """
+    def __init__(self, api_client, api_key, base_url, timeout=15, concurrency=10, rate_limiter=None):
+        self.client = ZoomAPIClient(api_client, api_key, base_url, timeout=timeout,
+                                    pool_size=concurrency, rate_limiter=rate_limiter)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    @classmethod
+    def from_client(cls, client, concurrency=10):
+        """Wrap an existing :class:`ZoomAPIClient`, sharing its session and rate budget."""
+        aclient = cls.__new__(cls)
+        aclient.client = client
+        aclient.concurrency = concurrency
+        aclient._executor = ThreadPoolExecutor(max_workers=concurrency)
+        return aclient
+
+    def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def list_meetings(self, **kwargs):
+        return await self._run(self.client.list_meetings, **kwargs)
+
+    async def list_webinars(self, **kwargs):
+        return await self._run(self.client.list_webinars, **kwargs)
+
+    async def get_meeting(self, meeting_id):
+        return await self._run(self.client.get_meeting, meeting_id)
+
+    async def list_participants_meeting(self, **kwargs):
+        return await self._run(self.client.list_participants_meeting, **kwargs)
+
+    async def list_participants_webinar(self, **kwargs):
+        return await self._run(self.client.list_participants_webinar, **kwargs)
+
+    async def list_registrants_meeting(self, **kwargs):
+        return await self._run(self.client.list_registrants_meeting, **kwargs)
+
+    async def add_registrant_meeting(self, meeting_id, **kwargs):
+        return await self._run(self.client.add_registrant_meeting, meeting_id, **kwargs)
+
+    async def set_webinar_addon(self, **kwargs):
+        return await self._run(self.client.set_webinar_addon, **kwargs)
 
+    async def list_user_webinars(self, **kwargs):
+        return await self._run(self.client.list_user_webinars, **kwargs)
 
+    async def get_webinar_details(self, **kwargs):
+        return await self._run(self.client.get_webinar_details, **kwargs)